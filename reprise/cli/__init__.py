@@ -62,7 +62,7 @@ async def parse_arguments() -> argparse.Namespace:
 
     group.add_argument('-r', '--rebuild', metavar='PORT', nargs='*', default=[], help='Port origin(s) to rebuild from ports')
     group.add_argument('-f', '--file', type=str, help='Path to file with port origin(s) to test (- to read from stdin)')
-    group.add_argument('ports', metavar='PORT', nargs='*', default=[], help='Ports (in category/port format) to test')
+    group.add_argument('ports', metavar='PORT', nargs='*', default=[], help='Ports (in category/port or category/port@flavor format) to test')
 
     group = parser.add_argument_group('Controlling the port behavior')
     group.add_argument('-V', '--vars', metavar='KEY=VALUE', nargs='+', default=[], type=str, help='Variables to set for the build via make.conf')
@@ -226,11 +226,14 @@ async def amain() -> None:
 
     results = []
 
-    for spec in jobspecs:
-        result = await runner.run(spec)
-        results.append(result)
-        if args.fail_fast and not result.is_ok():
-            break
+    try:
+        for spec in jobspecs:
+            result = await runner.run(spec)
+            results.append(result)
+            if args.fail_fast and not result.is_ok():
+                break
+    finally:
+        await repository_manager.close()
 
     if not args.quiet:
         print_results(results)
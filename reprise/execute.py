@@ -24,6 +24,7 @@ import traceback
 from collections import defaultdict
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Callable
 
 _logger = logging.getLogger('Execute')
 
@@ -59,7 +60,7 @@ def log_execute_time_statistics() -> None:
         logger.debug(f'{stats.total_duration:6.2f} {stats.calls:5} {stats.avg_duration:6.2f} {pos}')
 
 
-async def execute(program: str, *args: str, allow_failure: bool = False, cwd: Path | None = None) -> list[str]:
+async def execute(program: str, *args: str, allow_failure: bool = False, cwd: Path | None = None, preexec_fn: Callable[[], None] | None = None) -> list[str]:
     _logger.debug(' '.join([program] + list(args)))
 
     start = time.monotonic()
@@ -69,6 +70,7 @@ async def execute(program: str, *args: str, allow_failure: bool = False, cwd: Pa
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.DEVNULL if allow_failure else asyncio.subprocess.PIPE,
         cwd=cwd,
+        preexec_fn=preexec_fn,
     )
 
     stdout, stderr = await proc.communicate()
@@ -41,13 +41,15 @@ class PreparedJail:
 
 
 async def _check_jail_compilance(jail_zfs: ZFS, spec: JailSpec) -> bool:
-    if await jail_zfs.get_property_maybe('reprise:jail_ready_epoch') != str(_JAIL_EPOCH):
+    properties = await jail_zfs.get_properties_maybe(['reprise:jail_ready_epoch', 'reprise:jail_version', 'reprise:jail_arch'])
+
+    if properties.get('reprise:jail_ready_epoch') != str(_JAIL_EPOCH):
         return False
 
-    if await jail_zfs.get_property_maybe('reprise:jail_version') != spec.version:
+    if properties.get('reprise:jail_version') != spec.version:
         return False
 
-    if await jail_zfs.get_property_maybe('reprise:jail_arch') != spec.arch:
+    if properties.get('reprise:jail_arch') != spec.arch:
         return False
 
     return True
@@ -137,7 +139,7 @@ async def get_prepared_jail(workdir: Workdir, spec: JailSpec) -> PreparedJail:
     jail_zfs = workdir.get_jail_master(spec.name)
     jail_path = jail_zfs.get_path()
 
-    with file_lock(jail_path.with_suffix('.lock')):
+    async with file_lock(jail_path.with_suffix('.lock')):
         # we've moved from per-jail package datasets
         legacy_packages_zfs = workdir.get_packages().get_child(spec.name)
 
@@ -169,9 +171,11 @@ async def get_prepared_jail(workdir: Workdir, spec: JailSpec) -> PreparedJail:
 
             await jail_zfs.snapshot('clean')
 
-            await jail_zfs.set_property('reprise:jail_version', spec.version)
-            await jail_zfs.set_property('reprise:jail_arch', spec.arch)
-            await jail_zfs.set_property('reprise:jail_ready_epoch', str(_JAIL_EPOCH))
+            await jail_zfs.set_properties({
+                'reprise:jail_version': spec.version,
+                'reprise:jail_arch': spec.arch,
+                'reprise:jail_ready_epoch': str(_JAIL_EPOCH),
+            })
 
             logger.info(f'successfully created jail {spec.name}')
 
@@ -96,7 +96,7 @@ async def generate_jobs(args: argparse.Namespace, jail_manager: JailManager) ->
 
                 options_combinations.extend(
                     generate_options_combinations(
-                        await get_port_options_vars(defaults.portsdir / port),
+                        await get_port_options_vars(defaults.portsdir / port.partition('@')[0]),
                         include_options=set(args.include_options) if args.include_options else None,
                         exclude_options=set(args.exclude_options) if args.exclude_options else set(),
                     )
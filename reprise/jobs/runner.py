@@ -22,6 +22,7 @@ import functools
 import logging
 import os
 import shutil
+from collections import defaultdict
 from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
@@ -32,7 +33,7 @@ from reprise.jail.prepare import get_prepared_jail
 from reprise.jobs import JobSpec
 from reprise.lock import file_lock
 from reprise.mount.filesystems import mount_devfs, mount_nullfs, mount_tmpfs
-from reprise.plan.planner import Planner
+from reprise.plan.planner import Planner, PortMetadataCache
 from reprise.plan.tasks import TaskStatus
 from reprise.prison import NetworkingMode, start_prison
 from reprise.repository import RepositoryManager
@@ -41,8 +42,25 @@ from reprise.workdir import Workdir
 
 
 def _replace_in_file(path: Path, pattern: str, replacement: str) -> None:
-    with open(path, 'r') as fd:
-        data = fd.read().replace(pattern, replacement)
+    with open(path, 'r+') as fd:
+        data = fd.read()
+
+        if pattern not in data:
+            return
+
+        fd.seek(0)
+        fd.truncate()
+        fd.write(data.replace(pattern, replacement))
+
+
+def _write_if_changed(path: Path, data: str) -> None:
+    # avoid dirtying blocks shared with the jail snapshot
+    try:
+        with open(path, 'r') as fd:
+            if fd.read() == data:
+                return
+    except FileNotFoundError:
+        pass
 
     with open(path, 'w') as fd:
         fd.write(data)
@@ -93,13 +111,15 @@ class JobRunner:
 
     _workdir: Workdir
     _repository_manager: RepositoryManager
+    _metadata_caches: defaultdict[tuple[str, Path, str], PortMetadataCache]
 
     def __init__(self, workdir: Workdir, repository_manager: RepositoryManager) -> None:
         self._workdir = workdir
         self._repository_manager = repository_manager
+        self._metadata_caches = defaultdict(PortMetadataCache)
 
     async def _cleanup_jail(self, path: Path) -> None:
-        for resource in await enumerate_resources(path):
+        for resource in enumerate_resources(path):
             self._logger.debug(f'cleaning up jail resource: {resource}')
             await resource.destroy()
 
@@ -108,24 +128,37 @@ class JobRunner:
 
         self._logger.info(f'job started for {jobspec}')
 
-        jail = await get_prepared_jail(self._workdir, jobspec.jailspec)
-
         instance_name = f'{jobspec.jailspec.name}-{os.getpid()}'
 
         instance_zfs = self._workdir.get_jail_instance(instance_name)
+        instance_path = instance_zfs.get_path()
 
-        await self._cleanup_jail(instance_zfs.get_path())
+        await self._cleanup_jail(instance_path)
 
         try:
+            # these are independent and both may involve lengthy
+            # downloads, so run them concurrently
+            self._logger.debug('preparing jail and obtaining repository')
+            preparations = (
+                asyncio.create_task(get_prepared_jail(self._workdir, jobspec.jailspec)),
+                asyncio.create_task(self._repository_manager.get_repository(
+                    release=jobspec.jailspec.release,
+                    arch=jobspec.jailspec.arch
+                )),
+            )
+
+            try:
+                jail, repository = await asyncio.gather(*preparations)
+            finally:
+                # if either fails, don't leave the other one running
+                # past the cleanup and into the next job
+                for preparation in preparations:
+                    preparation.cancel()
+                await asyncio.gather(*preparations, return_exceptions=True)
+
             self._logger.debug(f'cloning instance {instance_name}')
             await instance_zfs.clone_from(jail.jail_zfs, 'clean', parents=True)
 
-            self._logger.debug('obtaining repository')
-            repository = await self._repository_manager.get_repository(
-                release=jobspec.jailspec.release,
-                arch=jobspec.jailspec.arch
-            )
-
             self._logger.debug('creating host directories')
             host_packages_path = repository.get_path()
             host_ccache_path = self._workdir.get_ccache().get_path() / ('nobody' if jobspec.build_as_nobody else 'root')
@@ -138,12 +171,12 @@ class JobRunner:
                     shutil.chown(host_ccache_path, 'nobody', 'nobody')
 
             self._logger.debug('creating jail directories')
-            jail_ports_path = instance_zfs.get_path() / 'usr' / 'ports'
-            jail_distfiles_path = instance_zfs.get_path() / 'distfiles'
-            jail_work_path = instance_zfs.get_path() / 'work'
-            jail_packages_path = instance_zfs.get_path() / 'packages'
-            jail_ccache_path = instance_zfs.get_path() / 'ccache'
-            jail_localbase_path = instance_zfs.get_path() / 'usr' / 'local'
+            jail_ports_path = instance_path / 'usr' / 'ports'
+            jail_distfiles_path = instance_path / 'distfiles'
+            jail_work_path = instance_path / 'work'
+            jail_packages_path = instance_path / 'packages'
+            jail_ccache_path = instance_path / 'ccache'
+            jail_localbase_path = instance_path / 'usr' / 'local'
 
             for path in [jail_ports_path, jail_distfiles_path, jail_work_path, jail_packages_path, jail_localbase_path]:
                 path.mkdir(parents=True, exist_ok=True)
@@ -152,18 +185,16 @@ class JobRunner:
                 jail_ccache_path.mkdir(parents=True, exist_ok=True)
 
             self._logger.debug('installing resolv.conf')
-            with open(instance_zfs.get_path() / 'etc' / 'resolv.conf', 'w') as fd:
-                fd.write('nameserver 8.8.8.8\n')
+            _write_if_changed(instance_path / 'etc' / 'resolv.conf', 'nameserver 8.8.8.8\n')
 
             self._logger.debug('installing make.conf')
-            with open(instance_zfs.get_path() / 'etc' / 'make.conf', 'w') as fd:
-                for k, v in jobspec.all_variables.items():
-                    fd.write(f'{k}={v}\n')
+            make_conf = ''.join(f'{k}={v}\n' for k, v in jobspec.all_variables.items())
+            _write_if_changed(instance_path / 'etc' / 'make.conf', make_conf)
 
             self._logger.debug('mounting filesystems')
 
             mounts = [
-                mount_devfs(instance_zfs.get_path() / 'dev'),
+                mount_devfs(instance_path / 'dev'),
                 mount_nullfs(jobspec.portsdir, jail_ports_path, readonly=True),
                 mount_nullfs(jobspec.distdir, jail_distfiles_path, readonly=False),
                 mount_nullfs(host_packages_path, jail_packages_path, readonly=False),
@@ -184,7 +215,7 @@ class JobRunner:
                 shutil.chown(jail_work_path, 'nobody', 'nobody')
 
             self._logger.debug('starting prison')
-            prison = await start_prison(instance_zfs.get_path(), networking=NetworkingMode.UNRESTRICTED, hostname='reprise-fetcher')
+            prison = await start_prison(instance_path, networking=NetworkingMode.UNRESTRICTED, hostname='reprise-fetcher')
 
             self._logger.debug('bootstrapping pkg')
 
@@ -205,23 +236,28 @@ class JobRunner:
             if pkg_info is None:
                 raise RuntimeError('no package for pkg')
             pkg_package = await repository.get_package(pkg_info)
-            await execute('tar', '-x', '-f', str(pkg_package.path), '-C', str(instance_zfs.get_path()), '--strip-components=1', '/usr/local/sbin/pkg-static')
+            await execute('tar', '-x', '-f', str(pkg_package.path), '-C', str(instance_path), '--strip-components=1', '/usr/local/sbin/pkg-static')
 
-            jail_pkg_path = instance_zfs.get_path() / 'usr/local/sbin/pkg'
-            jail_pkg_static_path = instance_zfs.get_path() / 'usr/local/sbin/pkg-static'
+            jail_pkg_path = instance_path / 'usr/local/sbin/pkg'
+            jail_pkg_static_path = instance_path / 'usr/local/sbin/pkg-static'
             jail_pkg_static_path.link_to(jail_pkg_path)
             # /pkg bootstrap
 
+            origin, _, flavor = jobspec.origin.partition('@')
+
             lines = await prison.execute(
                 'env',
                 '_LICENSE_STATUS=accepted',
-                MAKE_CMD, '-C', f'/usr/ports/{jobspec.origin}', '-V', 'IGNORE',
+                *((f'FLAVOR={flavor}',) if flavor else ()),
+                MAKE_CMD, '-C', f'/usr/ports/{origin}', '-V', 'IGNORE',
             )
 
             if lines and lines[0]:
                 return result(status=JobStatus.SKIPPED, details=f'{lines[0]}')
 
-            plan = await Planner(prison, repository).prepare(
+            metadata_cache = self._metadata_caches[(jobspec.jailspec.name, jobspec.portsdir, make_conf)]
+
+            plan = await Planner(prison, repository, metadata_cache).prepare(
                 jobspec.origin,
                 jobspec.origins_to_rebuild,
                 jobspec.build_as_nobody,
@@ -239,7 +275,7 @@ class JobRunner:
 
                 self._logger.info('fetching')
 
-                with file_lock(self._workdir.root.get_path() / 'fetch.lock'):
+                async with file_lock(self._workdir.root.get_path() / 'fetch.lock'):
                     if (status := await plan.fetch(prison, log=log)) != TaskStatus.SUCCESS:
                         self._logger.error(f'fetching failed, see log {log_path}')
                         return result(status=JobStatus.FETCH_TIMEOUT if status == TaskStatus.TIMEOUT else JobStatus.FETCH_FAILED)
@@ -247,7 +283,7 @@ class JobRunner:
                 self._logger.debug('setting up the prison for building')
 
                 await prison.destroy()  # XXX: implement and use modification of running prison
-                prison = await start_prison(instance_zfs.get_path(), networking=jobspec.networking_build, hostname='reprise-builder')
+                prison = await start_prison(instance_path, networking=jobspec.networking_build, hostname='reprise-builder')
 
                 self._logger.info('installation')
 
@@ -259,7 +295,7 @@ class JobRunner:
 
                 if jobspec.do_test:
                     await prison.destroy()  # XXX: implement and use modification of running prison
-                    prison = await start_prison(instance_zfs.get_path(), networking=jobspec.networking_test, hostname='reprise-tester')
+                    prison = await start_prison(instance_path, networking=jobspec.networking_test, hostname='reprise-tester')
 
                     self._logger.info('testing')
 
@@ -275,11 +311,11 @@ class JobRunner:
         finally:
             if jobspec.is_interactive:
                 self._logger.info('interactive mode: pausing before cleanup')
-                self._logger.info(f'* jail directory: {instance_zfs.get_path()}')
+                self._logger.info(f'* jail directory: {instance_path}')
                 self._logger.info('press any key to clean up the jail...')
                 input()
 
             self._logger.info('cleaning up')
-            await self._cleanup_jail(instance_zfs.get_path())
+            await self._cleanup_jail(instance_path)
 
         return result(status=JobStatus.CRASHED)
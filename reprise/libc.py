@@ -0,0 +1,163 @@
+# Copyright (C) 2022 Dmitry Marakasov <amdmi3@amdmi3.ru>
+#
+# This file is part of reprise
+#
+# reprise is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# reprise is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with reprise.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import ctypes
+import errno
+import os
+import sys
+from typing import Any, Callable, NoReturn
+
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+
+# FreeBSD 12+ layout
+class _StatFs(ctypes.Structure):
+    _fields_ = [
+        ('f_version', ctypes.c_uint32),
+        ('f_type', ctypes.c_uint32),
+        ('f_flags', ctypes.c_uint64),
+        ('f_bsize', ctypes.c_uint64),
+        ('f_iosize', ctypes.c_uint64),
+        ('f_blocks', ctypes.c_uint64),
+        ('f_bfree', ctypes.c_uint64),
+        ('f_bavail', ctypes.c_int64),
+        ('f_files', ctypes.c_uint64),
+        ('f_ffree', ctypes.c_int64),
+        ('f_syncwrites', ctypes.c_uint64),
+        ('f_asyncwrites', ctypes.c_uint64),
+        ('f_syncreads', ctypes.c_uint64),
+        ('f_asyncreads', ctypes.c_uint64),
+        ('f_spare', ctypes.c_uint64 * 10),
+        ('f_namemax', ctypes.c_uint32),
+        ('f_owner', ctypes.c_uint32),
+        ('f_fsid', ctypes.c_int32 * 2),
+        ('f_charspare', ctypes.c_char * 80),
+        ('f_fstypename', ctypes.c_char * 16),
+        ('f_mntfromname', ctypes.c_char * 1024),
+        ('f_mntonname', ctypes.c_char * 1024),
+    ]
+
+
+_MNT_NOWAIT = 2
+_MAXPATHLEN = 1024
+
+_JAIL_PARAM_JID = ctypes.create_string_buffer(b'jid')
+_JAIL_PARAM_LASTJID = ctypes.create_string_buffer(b'lastjid')
+_JAIL_PARAM_PATH = ctypes.create_string_buffer(b'path')
+
+
+# global symbol namespace, which includes libc; note that
+# jail functions are only present on FreeBSD
+_libc = ctypes.CDLL(None, use_errno=True)
+
+if sys.platform.startswith('freebsd'):
+    _libc.jail_get.argtypes = [ctypes.POINTER(_IoVec), ctypes.c_uint, ctypes.c_int]
+    _libc.jail_get.restype = ctypes.c_int
+    _libc.jail_attach.argtypes = [ctypes.c_int]
+    _libc.jail_attach.restype = ctypes.c_int
+    _libc.getfsstat.argtypes = [ctypes.POINTER(_StatFs), ctypes.c_long, ctypes.c_int]
+    _libc.getfsstat.restype = ctypes.c_int
+
+
+def _raise_errno() -> NoReturn:
+    err = ctypes.get_errno()
+    raise OSError(err, os.strerror(err))
+
+
+def _make_jail_params(*params: tuple[ctypes.Array[ctypes.c_char], Any]) -> ctypes.Array[_IoVec]:
+    # jail(2) parameters are passed as name and value iovec pairs;
+    # the caller must keep values alive while the result is used
+    iov = (_IoVec * (len(params) * 2))()
+    for i, (name, value) in enumerate(params):
+        iov[i * 2].iov_base = ctypes.addressof(name)
+        iov[i * 2].iov_len = ctypes.sizeof(name)
+        iov[i * 2 + 1].iov_base = ctypes.addressof(value)
+        iov[i * 2 + 1].iov_len = ctypes.sizeof(value)
+    return iov
+
+
+def jail_exists(jid: int) -> bool:
+    value = ctypes.c_int(jid)
+    iov = _make_jail_params((_JAIL_PARAM_JID, value))
+
+    if _libc.jail_get(iov, len(iov), 0) != -1:
+        return True
+    elif ctypes.get_errno() == errno.ENOENT:
+        return False
+
+    _raise_errno()
+
+
+def get_jails() -> list[tuple[int, str]]:
+    # like `jls`, returns jid and path of each jail
+    lastjid = ctypes.c_int(0)
+    path = ctypes.create_string_buffer(_MAXPATHLEN)
+    iov = _make_jail_params((_JAIL_PARAM_LASTJID, lastjid), (_JAIL_PARAM_PATH, path))
+
+    res = []
+
+    while (jid := _libc.jail_get(iov, len(iov), 0)) != -1:
+        res.append((jid, os.fsdecode(path.value)))
+        lastjid.value = jid
+
+    if ctypes.get_errno() != errno.ENOENT:
+        _raise_errno()
+
+    return res
+
+
+def get_jail_attacher(jid: int) -> Callable[[], None]:
+    # the function is resolved beforehand, as the returned callable
+    # is to be run in a forked child where it's unsafe to do so
+    jail_attach = _libc.jail_attach
+
+    def attach() -> None:
+        # same as what jexec does when no user is specified
+        if jail_attach(jid) == -1:
+            _raise_errno()
+        os.chdir('/')
+
+    return attach
+
+
+def get_mounts() -> list[tuple[str, str, str]]:
+    # like `mount -p`, returns source, mountpoint and type of each mount
+    while True:
+        count = _libc.getfsstat(None, 0, _MNT_NOWAIT)
+        if count == -1:
+            _raise_errno()
+
+        # reserve some space in case more filesystems are mounted meanwhile
+        buf = (_StatFs * (count + 16))()
+
+        count = _libc.getfsstat(buf, ctypes.sizeof(buf), _MNT_NOWAIT)
+        if count == -1:
+            _raise_errno()
+        elif count < len(buf):
+            break
+
+    return [
+        (os.fsdecode(statfs.f_mntfromname), os.fsdecode(statfs.f_mntonname), os.fsdecode(statfs.f_fstypename))
+        for statfs in buf[:count]
+    ]
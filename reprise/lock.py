@@ -15,22 +15,33 @@
 # You should have received a copy of the GNU General Public License
 # along with reprise.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import fcntl
 import logging
-from contextlib import contextmanager
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Iterator
+from typing import AsyncIterator
 
+_LOCK_POLL_INTERVAL = 0.05
 
-@contextmanager
-def file_lock(path: Path) -> Iterator[None]:
+_logger = logging.getLogger('Locking')
+
+
+@asynccontextmanager
+async def file_lock(path: Path) -> AsyncIterator[None]:
     with open(path, 'w+') as fd:
         try:
             fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
         except BlockingIOError:
-            logger = logging.getLogger('Locking')
-            logger.debug(f'waiting on lock {path}')
-            fcntl.flock(fd, fcntl.LOCK_EX)
-            logger.debug(f'done waiting on lock {path}')
+            _logger.debug(f'waiting on lock {path}')
+            # blocking flock would stall the whole event loop, so poll instead
+            while True:
+                await asyncio.sleep(_LOCK_POLL_INTERVAL)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    pass
+            _logger.debug(f'done waiting on lock {path}')
 
         yield
@@ -20,22 +20,32 @@ import time
 
 
 def _format_seconds(secs: float) -> str:
-    seconds = int(secs) % 60
-    minutes = int(secs) // 60 % 60
-    hour = int(secs) // 3600
-    return f'{hour:02}:{minutes:02}:{seconds:02}'
+    minutes, seconds = divmod(int(secs), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours:02}:{minutes:02}:{seconds:02}'
 
 
 class ElapsedFormatter(logging.Formatter):
     _start_time: float
+    _last_elapsed_secs: int
+    _last_elapsed_str: str
 
     def __init__(self) -> None:
         super().__init__()
         self._start_time = time.time()
+        self._last_elapsed_secs = -1
+        self._last_elapsed_str = ''
 
     def formatMessage(self, record: logging.LogRecord) -> str:  # noqa
-        elapsed = _format_seconds(record.created - self._start_time)
-        return f'[{elapsed}][{record.name}]: {record.getMessage()}'
+        # output resolution is 1 second, so reuse formatted value
+        # for all records which fall into the same second
+        elapsed_secs = int(record.created - self._start_time)
+        if elapsed_secs != self._last_elapsed_secs:
+            self._last_elapsed_secs = elapsed_secs
+            self._last_elapsed_str = _format_seconds(elapsed_secs)
+        # all our logging uses preformatted messages, skip %-formatting for these
+        message = record.getMessage() if record.args else record.msg
+        return f'[{self._last_elapsed_str}][{record.name}]: {message}'
 
 
 def setup_logging(debug: bool) -> None:
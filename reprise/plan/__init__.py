@@ -15,12 +15,15 @@
 # You should have received a copy of the GNU General Public License
 # along with reprise.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import logging
-from typing import TextIO
+from typing import Iterable, TextIO
 
 from reprise.plan.tasks import Task, TaskStatus
 from reprise.prison import Prison
 
+_MAX_PARALLEL_FETCHES = 8
+
 
 class Plan:
     _logger = logging.getLogger('Plan')
@@ -33,14 +36,34 @@ class Plan:
     def add_task(self, task: Task) -> None:
         self._tasks.append(task)
 
+    def add_tasks(self, tasks: Iterable[Task]) -> None:
+        self._tasks.extend(tasks)
+
     async def fetch(self, jail: Prison, log: TextIO) -> TaskStatus:
         self._logger.debug('fetch started')
 
-        status = TaskStatus.SUCCESS
+        semaphore = asyncio.Semaphore(_MAX_PARALLEL_FETCHES)
 
-        for task in self._tasks:
-            if status == TaskStatus.SUCCESS:
-                status = await task.fetch(jail, log)
+        async def fetch_task(task: Task) -> TaskStatus:
+            async with semaphore:
+                return await task.fetch(jail, log)
+
+        fetches = [asyncio.create_task(fetch_task(task)) for task in self._tasks if task.can_fetch_concurrently]
+
+        try:
+            statuses = await asyncio.gather(*fetches)
+        finally:
+            # on failure, don't leave remaining downloads running behind
+            for fetch in fetches:
+                fetch.cancel()
+            await asyncio.gather(*fetches, return_exceptions=True)
+
+        status = next((status for status in statuses if status != TaskStatus.SUCCESS), TaskStatus.SUCCESS)
+
+        if status == TaskStatus.SUCCESS:
+            for task in self._tasks:
+                if not task.can_fetch_concurrently and (status := await task.fetch(jail, log)) != TaskStatus.SUCCESS:
+                    break
 
         self._logger.debug(f'fetch finished: {status.name}')
 
@@ -52,8 +75,8 @@ class Plan:
         status = TaskStatus.SUCCESS
 
         for task in self._tasks:
-            if status == TaskStatus.SUCCESS:
-                status = await task.install(jail, log)
+            if (status := await task.install(jail, log)) != TaskStatus.SUCCESS:
+                break
 
         self._logger.debug(f'install finished: {status.name}')
 
@@ -65,8 +88,8 @@ class Plan:
         status = TaskStatus.SUCCESS
 
         for task in self._tasks:
-            if status == TaskStatus.SUCCESS:
-                status = await task.test(jail, log)
+            if (status := await task.test(jail, log)) != TaskStatus.SUCCESS:
+                break
 
         self._logger.debug(f'testing finished: {status.name}')
 
@@ -17,115 +17,229 @@
 
 from __future__ import annotations
 
+import asyncio
 import logging
-from dataclasses import dataclass
-from pathlib import Path
-from typing import Optional
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Iterable
 
 from reprise.commands import MAKE_CMD
+from reprise.compat import dataclass_slots_arg
 from reprise.plan import Plan
 from reprise.plan.tasks import PackageTask, PortTask, Task
 from reprise.prison import Prison
 from reprise.repository import Repository
 from reprise.types import Port
 
+# make queries are read-only, so many of these may be run in a jail at once
+_MAX_PARALLEL_QUERIES = 8
 
-@dataclass
+# variables to query for each port; the output is parsed positionally,
+# with all but the last *_DEPENDS being normal dependencies
+_MAKE_VARS = (
+    'PKGNAME',
+    'FLAVOR',
+    'PKG_DEPENDS',
+    'EXTRACT_DEPENDS',
+    'BUILD_DEPENDS',
+    'RUN_DEPENDS',
+    'LIB_DEPENDS',
+    'TEST_DEPENDS',
+)
+_MAKE_V_ARGS = tuple(arg for var in _MAKE_VARS for arg in ('-V', var))
+
+# for topological sorting
+_VisitState = Enum('_VisitState', 'NEW ACTIVE DONE')
+
+
+def _depend_to_port(depend: str) -> Port:
+    # dependency format is dep:origin[@flavor][:target]
+    origin, sep, flavor = depend.split(':', 2)[1].partition('@')
+    return Port(origin, flavor if sep else None)
+
+
+@dataclass(**dataclass_slots_arg)
 class _TaskItem:
     task: Task
-    consumers: list[Optional['_TaskItem']]
-    visited: bool = False  # for topological sorting
+    depends: list[_TaskItem] = field(default_factory=list)
+    state: _VisitState = _VisitState.NEW
 
 
-@dataclass
+@dataclass(**dataclass_slots_arg)
 class _QueueItem:
     port: Port | None = None
     pkgname: str | None = None
-    consumer: _TaskItem | None = None
+    consumers: list[_TaskItem | None] = field(default_factory=list)
+    metadata: _PortMetadata | None = None
 
 
-@dataclass
-class _PortDepends:
+@dataclass(**dataclass_slots_arg)
+class _PortMetadata:
+    pkgname: str
+    flavor: str | None
     depends: set[Port]
     test_depends: set[Port]
 
 
+# port metadata only depends on the ports tree, the jail and make.conf,
+# so it may be shared between planners for jobs where these match
+PortMetadataCache = dict[Port, _PortMetadata]
+
+
 class Planner:
     _logger = logging.getLogger('Planner')
 
     _jail: Prison
     _repository: Repository
+    _query_semaphore: asyncio.Semaphore
+
+    _metadata_cache: PortMetadataCache
+    _metadata_locks: defaultdict[Port, asyncio.Lock]
 
-    def __init__(self, jail: Prison, repository: Repository) -> None:
+    def __init__(self, jail: Prison, repository: Repository, metadata_cache: PortMetadataCache | None = None) -> None:
         self._jail = jail
         self._repository = repository
+        self._query_semaphore = asyncio.Semaphore(_MAX_PARALLEL_QUERIES)
+        self._metadata_cache = {} if metadata_cache is None else metadata_cache
+        self._metadata_locks = defaultdict(asyncio.Lock)
 
-    async def _get_port_depends(self, port: Port) -> _PortDepends:
+    async def _query_port_metadata(self, port: Port) -> _PortMetadata:
         flavor_args = ('env', 'FLAVOR=' + port.flavor) if port.flavor is not None else ()
 
-        lines = await self._jail.execute(
-            *flavor_args,
-            MAKE_CMD, '-C', str(Path('/usr/ports') / port.origin),
-            '-V', 'PKG_DEPENDS',
-            '-V', 'EXTRACT_DEPENDS',
-            '-V', 'BUILD_DEPENDS',
-            '-V', 'RUN_DEPENDS',
-            '-V', 'LIB_DEPENDS',
-            '-V', 'TEST_DEPENDS'
+        # make startup (parsing of the ports framework) is expensive,
+        # so everything we need is queried in a single call
+        async with self._query_semaphore:
+            lines = await self._jail.execute(
+                *flavor_args,
+                MAKE_CMD, '-C', f'/usr/ports/{port.origin}', *_MAKE_V_ARGS
+            )
+
+        return _PortMetadata(
+            pkgname=lines[0].rsplit('-', 1)[0],
+            flavor=lines[1] or None,
+            depends={_depend_to_port(depend) for line in lines[2:-1] for depend in line.split()},
+            test_depends={_depend_to_port(depend) for depend in lines[-1].split()},
         )
 
-        def depend2port(depend: str) -> Port:
-            origin, *flavor = depend.split(':')[1].split('@', 1)
-            return Port(origin, flavor[0] if flavor else None)
+    async def _get_port_metadata(self, port: Port) -> _PortMetadata:
+        # per-port lock makes concurrent requests for the same port wait
+        # for a single query instead of running their own ones
+        async with self._metadata_locks[port]:
+            if (metadata := self._metadata_cache.get(port)) is None:
+                metadata = await self._query_port_metadata(port)
+                self._metadata_cache[port] = metadata
+                if port.flavor is None and metadata.flavor is not None:
+                    # default flavor was used, so this is valid for explicit flavor as well
+                    self._metadata_cache.setdefault(Port(port.origin, metadata.flavor), metadata)
 
-        return _PortDepends(
-            depends=set(map(depend2port, ' '.join(lines[0:-1]).split())),
-            test_depends=set(map(depend2port, lines[-1].split())),
-        )
+        return metadata
 
-    async def _get_port_package_name(self, port: Port) -> str:
-        flavor_args = ('env', 'FLAVOR=' + port.flavor) if port.flavor is not None else ()
+    async def _prefetch_metadata(self, items: Iterable[_QueueItem], origin: str, origins_to_rebuild: set[str]) -> None:
+        wanted: list[tuple[_QueueItem, Port]] = []
 
-        return (await self._jail.execute(
-            *flavor_args, MAKE_CMD, '-C', f'/usr/ports/{port.origin}', '-V', 'PKGNAME'
-        ))[0].rsplit('-', 1)[0]
+        for item in items:
+            if item.metadata is not None:
+                continue
+            elif item.port is not None:
+                # port dependency, metadata is needed to get package name
+                wanted.append((item, item.port))
+            else:
+                # package dependency, metadata is only needed if it's going to be built
+                assert item.pkgname is not None
+                manifest = self._repository.get_package_info_by_name(item.pkgname)
+                if manifest is not None and (manifest.origin == origin or manifest.origin in origins_to_rebuild):
+                    wanted.append((item, manifest.port))
 
-    async def _get_port_default_flavor(self, origin: str) -> str | None:
-        lines = await self._jail.execute(MAKE_CMD, '-C', f'/usr/ports/{origin}', '-V', 'FLAVOR')
+        ports = list({port for _, port in wanted})
+        fetched = dict(zip(ports, await asyncio.gather(*map(self._get_port_metadata, ports))))
 
-        return lines[0] if lines and lines[0] else None
+        for item, port in wanted:
+            item.metadata = fetched[port]
 
     async def prepare(self, origin: str, origins_to_rebuild: set[str], build_as_nobody: bool, fetch_timeout: int, build_timeout: int, test_timeout: int) -> Plan:
         tasks: dict[str, _TaskItem] = {}
-        queue = [
-            # the primary port to test
-            _QueueItem(port=Port(origin, await self._get_port_default_flavor(origin)))
-        ]
+        tasks_by_port: dict[Port, _TaskItem] = {}
+        enqueued: dict[Port | str, _QueueItem] = {}
+
+        # tasks not required by other tasks: the primary port
+        # and its test dependencies, starting points for sorting
+        roots: list[_TaskItem] = []
+
+        def link(task_item: _TaskItem, consumers: list[_TaskItem | None]) -> None:
+            for consumer in consumers:
+                if consumer is None:
+                    roots.append(task_item)
+                else:
+                    consumer.depends.append(task_item)
+
+        # the primary port to test, either with explicitly specified
+        # flavor, or, if it's omitted, querying it without a flavor gives
+        # us its default flavor along with other metadata
+        origin, _, flavor = origin.partition('@')
+        primary_metadata = await self._get_port_metadata(Port(origin, flavor or None))
+        queue = deque([
+            _QueueItem(
+                port=Port(origin, flavor or primary_metadata.flavor),
+                pkgname=primary_metadata.pkgname,
+                consumers=[None],
+                metadata=primary_metadata,
+            )
+        ])
+
+        def enqueue(consumer: _TaskItem | None, port: Port | None = None, pkgname: str | None = None) -> None:
+            # a dependency may be reached from many consumers, so instead of
+            # processing it over and over, just register new graph edges
+            if port is not None:
+                key: Port | str = port
+                task_item = tasks_by_port.get(port)
+            else:
+                assert pkgname is not None
+                key = pkgname
+                task_item = tasks.get(pkgname)
+
+            if task_item is not None:
+                link(task_item, [consumer])
+            elif (queue_item := enqueued.get(key)) is not None:
+                queue_item.consumers.append(consumer)
+            else:
+                enqueued[key] = _QueueItem(port=port, pkgname=pkgname, consumers=[consumer])
+                queue.append(enqueued[key])
 
-        queue_pos = 0
-        while queue_pos < len(queue):
-            item = queue[queue_pos]
-            queue_pos += 1
+        layer_left = 0
+        while queue:
+            if not layer_left:
+                # entering the next layer of the dependency graph;
+                # fetch metadata for all ports in it concurrently
+                layer_left = len(queue)
+                await self._prefetch_metadata(queue, origin, origins_to_rebuild)
+
+            item = queue.popleft()
+            layer_left -= 1
 
             # either of item.pkgname or item.port may be undefined, but we need both
             if item.pkgname is None:
-                assert item.port is not None
-                item.pkgname = await self._get_port_package_name(item.port)
+                assert item.metadata is not None
+                item.pkgname = item.metadata.pkgname
+
+            # from now on, the dependency is tracked as a task
+            enqueued.pop(item.port if item.port is not None else item.pkgname, None)
 
             # early exit if this dependecy was already processed
             # we just need to register it in the graph
-            if item.pkgname in tasks:
-                tasks[item.pkgname].consumers.append(item.consumer)
+            if (task_item := tasks.get(item.pkgname)) is not None:
+                link(task_item, item.consumers)
+                if item.port is not None:
+                    tasks_by_port[item.port] = task_item
                 continue
 
-            # either of item.pkgname or item.port may be undefined, but we need both
-            manifest = None
+            # manifest is needed both to resolve port for package
+            # dependencies and to decide whether package may be used
+            manifest = self._repository.get_package_info_by_name(item.pkgname)
             if item.port is None:
-                assert item.pkgname is not None
-                manifest = self._repository.get_package_info_by_name(item.pkgname)
                 if manifest is None:
-                    raise RuntimeError('unexpected package repository inconsistency: no manifest for {item.pkgname}')
-                item.port = Port(manifest.origin, manifest.flavor)
+                    raise RuntimeError(f'unexpected package repository inconsistency: no manifest for {item.pkgname}')
+                item.port = manifest.port
 
             want_testing = item.port.origin == origin
             prefer_package = not want_testing and item.port.origin not in origins_to_rebuild
@@ -133,26 +247,22 @@ class Planner:
             self._logger.debug(f'processing {item.port} aka {item.pkgname}, testing={want_testing}, prefer_package={prefer_package}')
 
             if prefer_package:
-                # manifest may be None here if it hasn't been loaded yet
-                if manifest is None:
-                    manifest = self._repository.get_package_info_by_name(item.pkgname)
-
                 # manifest may be None if the package does not exist in the repository,
                 # in which case we'll fallback to the port building
                 if manifest is not None:
-                    pkgdepends = manifest.deps if manifest.deps is not None else {}
-                    task_item = _TaskItem(
-                        PackageTask(self._repository, manifest),
-                        [item.consumer]
-                    )
+                    pkgdepends = manifest.deps
+                    task_item = _TaskItem(PackageTask(self._repository, manifest))
+                    link(task_item, item.consumers)
                     tasks[item.pkgname] = task_item
-                    queue.extend(_QueueItem(pkgname=pkgname, consumer=task_item) for pkgname in pkgdepends)
+                    tasks_by_port[item.port] = task_item
+                    for pkgname in pkgdepends:
+                        enqueue(task_item, pkgname=pkgname)
                     self._logger.debug(f'planned {item.pkgname} as package, enqueued {len(pkgdepends)} depend(s): {" ".join(map(str, pkgdepends))}')
                     continue
 
                 self._logger.debug(f'no package {item.pkgname} available, falling back to building from port')
 
-            portdepends = await self._get_port_depends(item.port)
+            portdepends = item.metadata if item.metadata is not None else await self._get_port_metadata(item.port)
             task_item = _TaskItem(
                 PortTask(
                     item.port,
@@ -161,36 +271,56 @@ class Planner:
                     fetch_timeout=fetch_timeout,
                     build_timeout=build_timeout,
                     test_timeout=test_timeout
-                ),
-                [item.consumer]
+                )
             )
+            link(task_item, item.consumers)
             tasks[item.pkgname] = task_item
-            queue.extend(_QueueItem(port=port, consumer=task_item) for port in portdepends.depends)
+            tasks_by_port[item.port] = task_item
+            for port in portdepends.depends:
+                enqueue(task_item, port=port)
             if want_testing:
                 # test depends do not intoduce edges for topological sorting
                 # in order not to create dependency loops
-                queue.extend(_QueueItem(port=port, consumer=None) for port in portdepends.test_depends)
+                for port in portdepends.test_depends:
+                    enqueue(None, port=port)
                 self._logger.debug(f'planned {item.port} as port, enqueued {len(portdepends.depends)} normal depend(s): {" ".join(map(str, portdepends.depends))} and {len(portdepends.test_depends)} test depend(s): {" ".join(map(str, portdepends.test_depends))}')
             else:
                 self._logger.debug(f'planned {item.port} as port, enqueued {len(portdepends.depends)} depend(s): {" ".join(map(str, portdepends.depends))}')
 
-        # topological sort
+        # topological sort; postorder of DFS over dependencies
+        # directly gives the order in which tasks are to be installed
         topological_sorted: list[_TaskItem] = []
 
-        def toposort(task: _TaskItem, stack: list[_TaskItem]) -> None:
-            task.visited = True
-
-            for consumer in task.consumers:
-                if consumer is not None and not consumer.visited:
-                    toposort(consumer, stack)
-
-            stack.append(task)
+        # iterative DFS, as dependency graphs may be deep enough
+        # to hit python recursion limit
+        for root in roots:
+            if root.state != _VisitState.NEW:
+                continue
 
-        for task in tasks.values():
-            if not task.visited:
-                toposort(task, topological_sorted)
+            root.state = _VisitState.ACTIVE
+            stack = [(root, iter(root.depends))]
+
+            while stack:
+                task, depends = stack[-1]
+                for depend in depends:
+                    if depend.state == _VisitState.DONE:
+                        continue
+                    elif depend.state == _VisitState.ACTIVE:
+                        cycle_start = next(i for i, (item, _) in enumerate(stack) if item is depend)
+                        cycle = [item.task for item, _ in stack[cycle_start:]] + [depend.task]
+                        raise RuntimeError(f'dependency cycle detected: {" -> ".join(map(str, cycle))}')
+
+                    depend.state = _VisitState.ACTIVE
+                    stack.append((depend, iter(depend.depends)))
+                    break
+                else:
+                    task.state = _VisitState.DONE
+                    topological_sorted.append(task)
+                    stack.pop()
+
+        # every task was reached from some root, so all should be sorted
+        assert len(topological_sorted) == len(tasks)
 
         plan = Plan()
-        for task in reversed(topological_sorted):
-            plan.add_task(task.task)
+        plan.add_tasks(task.task for task in topological_sorted)
         return plan
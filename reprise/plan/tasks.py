@@ -29,6 +29,28 @@ from reprise.types import Port
 
 TaskStatus = Enum('TaskStatus', 'SUCCESS FAILURE TIMEOUT')
 
+# environment common to all port phases
+_PORT_ENV = (
+    'BATCH=1',
+    'DISTDIR=/distfiles',
+    'WRKDIRPREFIX=/work',
+    'USE_PACKAGE_DEPENDS_ONLY=1',
+    '_LICENSE_STATUS=accepted',
+)
+
+
+def _banner(title: str) -> str:
+    separator = '=' * 80 + '\n'
+    return separator + f'= {title} '.ljust(80, '=') + '\n' + separator
+
+
+_FETCH_BANNER = _banner('Fetch phase')
+_PKG_LIST_BANNER = _banner('Listing installed packages before build')
+_BUILD_BANNER = _banner('Build package phase')
+_INSTALL_BANNER = _banner('Install package phase')
+_SHLIB_LIST_BANNER = _banner('Listing used shared libraries')
+_TEST_BANNER = _banner('Testing phase')
+
 
 def _code_to_status(code: int) -> TaskStatus:
     if code == 124:  # timeout exist status, see timeout(1)
@@ -51,6 +73,9 @@ def _timeout_arg(timeout: int, killtime: int = 30) -> tuple[str, ...]:
 class Task(ABC):
     _logger = logging.getLogger('Task')
 
+    # whether fetch may be run concurrently with other tasks' fetches
+    can_fetch_concurrently: bool = False
+
     @abstractmethod
     async def fetch(self, prison: Prison, log: TextIO) -> TaskStatus:
         pass
@@ -65,6 +90,9 @@ class Task(ABC):
 
 
 class PackageTask(Task):
+    # Repository handles concurrent fetches of the same package
+    can_fetch_concurrently = True
+
     _repository: Repository
     _package_info: PackageInfo
 
@@ -99,6 +127,12 @@ class PortTask(Task):
     _build_timeout: int
     _test_timeout: int
 
+    _flavor_env: tuple[str, ...]
+    _fetch_env: tuple[str, ...]
+    _build_env: tuple[str, ...]
+    _install_env: tuple[str, ...]
+    _test_env: tuple[str, ...]
+
     def __init__(self, port: Port, do_test: bool, build_as_nobody: bool, fetch_timeout: int, build_timeout: int, test_timeout: int) -> None:
         self._port = port
         self._do_test = do_test
@@ -107,30 +141,26 @@ class PortTask(Task):
         self._build_timeout = build_timeout
         self._test_timeout = test_timeout
 
+        self._flavor_env = ('FLAVOR=' + port.flavor,) if port.flavor is not None else ()
+        self._fetch_env = ('env', *_PORT_ENV, 'PKG_ADD=false', 'NO_IGNORE=1', *self._flavor_env)
+        self._build_env = ('env', *_PORT_ENV, 'DEVELOPER=1', 'PKG_ADD=false', 'FORCE_PACKAGE=true', *self._flavor_env)
+        # XXX: PKG_ADD is specifically allowed here for install-package to work
+        # in fact, we should call it explicitly on WRKDIR_PKGFILE
+        self._install_env = ('env', *_PORT_ENV, *self._flavor_env)
+        self._test_env = ('env', *_PORT_ENV, 'PKG_ADD=false', *self._flavor_env)
+
     def __repr__(self) -> str:
         return f'PortTask({self._port}, test={self._do_test})'
 
-    def _flavorenv(self) -> tuple[str, ...]:
-        return ('FLAVOR=' + self._port.flavor,) if self._port.flavor is not None else ()
-
     async def fetch(self, prison: Prison, log: TextIO) -> TaskStatus:
         self._logger.debug(f'started fetching distfiles for port {self._port}')
 
-        print('================================================================================', file=log)
-        print('= Fetch phase ==================================================================', file=log)
-        print('================================================================================', file=log, flush=True)
+        log.write(_FETCH_BANNER)
+        log.flush()
 
         returncode = await prison.execute_by_line(
             *_timeout_arg(self._fetch_timeout),
-            'env',
-            'BATCH=1',
-            'DISTDIR=/distfiles',
-            'WRKDIRPREFIX=/work',
-            'PKG_ADD=false',
-            'USE_PACKAGE_DEPENDS_ONLY=1',
-            'NO_IGNORE=1',
-            '_LICENSE_STATUS=accepted',
-            *self._flavorenv(),
+            *self._fetch_env,
             MAKE_CMD, '-C', f'/usr/ports/{self._port.origin}', 'checksum',
             log=log,
         )
@@ -142,26 +172,15 @@ class PortTask(Task):
     async def install(self, prison: Prison, log: TextIO) -> TaskStatus:
         self._logger.debug(f'started installation for port {self._port}')
 
-        print('================================================================================', file=log)
-        print('= Listing installed packages before build ======================================', file=log)
-        print('================================================================================', file=log, flush=True)
+        log.write(_PKG_LIST_BANNER)
+        log.flush()
         await prison.execute_by_line('pkg', 'info', '-q', log=log)
 
-        print('================================================================================', file=log)
-        print('= Build package phase ==========================================================', file=log)
-        print('================================================================================', file=log, flush=True)
+        log.write(_BUILD_BANNER)
+        log.flush()
         returncode = await prison.execute_by_line(
             *_timeout_arg(self._build_timeout),
-            'env',
-            'BATCH=1',
-            'DEVELOPER=1',
-            'DISTDIR=/distfiles',
-            'WRKDIRPREFIX=/work',
-            'PKG_ADD=false',
-            'USE_PACKAGE_DEPENDS_ONLY=1',
-            'FORCE_PACKAGE=true',
-            '_LICENSE_STATUS=accepted',
-            *self._flavorenv(),
+            *self._build_env,
             MAKE_CMD, '-C', f'/usr/ports/{self._port.origin}', 'stage', 'check-plist', 'package',
             log=log,
             user='nobody' if self._build_as_nobody else None,
@@ -172,20 +191,11 @@ class PortTask(Task):
         if (status := _code_to_status(returncode)) != TaskStatus.SUCCESS:
             return status
 
-        print('================================================================================', file=log)
-        print('= Install package phase ========================================================', file=log)
-        print('================================================================================', file=log, flush=True)
+        log.write(_INSTALL_BANNER)
+        log.flush()
 
         returncode = await prison.execute_by_line(
-            'env',
-            'BATCH=1',
-            'DISTDIR=/distfiles',
-            'WRKDIRPREFIX=/work',
-            # XXX: PKG_ADD is specifically allowed here for install-package to work
-            # in fact, we should call it explicitly on WRKDIR_PKGFILE
-            'USE_PACKAGE_DEPENDS_ONLY=1',
-            '_LICENSE_STATUS=accepted',
-            *self._flavorenv(),
+            *self._install_env,
             MAKE_CMD, '-C', f'/usr/ports/{self._port.origin}', 'install-package',
             log=log,
         )
@@ -195,13 +205,12 @@ class PortTask(Task):
         if (status := _code_to_status(returncode)) != TaskStatus.SUCCESS:
             return status
 
-        print('================================================================================', file=log)
-        print('= Listing used shared libraries ================================================', file=log)
-        print('================================================================================', file=log, flush=True)
+        log.write(_SHLIB_LIST_BANNER)
+        log.flush()
 
         await prison.execute_by_line(
             'env',
-            *self._flavorenv(),
+            *self._flavor_env,
             # installed by _add_scripts
             '/reprise-list-shared-libs', f'/usr/ports/{self._port.origin}',
             log=log,
@@ -215,23 +224,15 @@ class PortTask(Task):
 
         self._logger.debug(f'started testing for port {self._port}')
 
-        print('================================================================================', file=log)
-        print('= Testing phase ================================================================', file=log)
-        print('================================================================================', file=log, flush=True)
+        log.write(_TEST_BANNER)
+        log.flush()
 
         returncode = await prison.execute_by_line(
             *_timeout_arg(self._test_timeout),
             'limits',
             '-Bc',
             'unlimited',  # XXX: make this tunable
-            'env',
-            'BATCH=1',
-            'DISTDIR=/distfiles',
-            'WRKDIRPREFIX=/work',
-            'PKG_ADD=false',
-            'USE_PACKAGE_DEPENDS_ONLY=1',
-            '_LICENSE_STATUS=accepted',
-            *self._flavorenv(),
+            *self._test_env,
             MAKE_CMD, '-C', f'/usr/ports/{self._port.origin}', 'test',
             log=log,
             user='nobody' if self._build_as_nobody else None,
@@ -18,46 +18,64 @@
 from __future__ import annotations
 
 import asyncio
+import functools
 import logging
 import os
 import pwd
 import time
 from enum import Enum
 from pathlib import Path
-from typing import Any, TextIO
+from typing import Any, Callable, TextIO
 
-from reprise.commands import JAIL_CMD, JEXEC_CMD, JLS_CMD
+from reprise.commands import JAIL_CMD, JEXEC_CMD
 from reprise.execute import execute, register_execute_time
+from reprise.libc import get_jail_attacher, jail_exists
 from reprise.resources import Resource
 
 _logger = logging.getLogger('Prison')
 
+_DESTROY_POLL_MIN_INTERVAL = 0.01
+_DESTROY_POLL_MAX_INTERVAL = 1.0
+
+
+@functools.lru_cache(maxsize=None)
+def _get_uid(user: str) -> int:
+    return pwd.getpwnam(user).pw_uid
+
 
 class Prison(Resource):
     _jid: int
     _path: Path
 
+    _command_prefixes: dict[str | None, tuple[tuple[str, ...], Callable[[], None] | None]]
+
     def __init__(self, jid: int, path: Path) -> None:
         self._jid = jid
         self._path = path
+        self._command_prefixes = {}
 
     async def execute(self, program: str, *args: Any, **kwargs: Any) -> list[str]:
-        return await execute(
-            JEXEC_CMD, '-l', str(self._jid),
-            '/usr/bin/env',
-            # XXX: may be changed to -L- when 12.x is gone
-            '-L0',
-            program, *args, **kwargs
-        )
+        prefix_args, preexec_fn = self._get_command_prefix(None)
 
-    async def execute_by_line(self, program: str, *args: Any, log: TextIO | None, user: str | None = None) -> int:
-        user_args = ('-u', user) if user is not None else ()
+        return await execute(*prefix_args, program, *args, preexec_fn=preexec_fn, **kwargs)
+
+    def _get_command_prefix(self, user: str | None) -> tuple[tuple[str, ...], Callable[[], None] | None]:
+        if (prefix := self._command_prefixes.get(user)) is not None:
+            return prefix
 
-        full_args = [
+        if user is not None:
+            # jexec also sets up login context for the user, so it's used here
+            jexec_args: tuple[str, ...] = (JEXEC_CMD, '-u', user, str(self._jid))
+            preexec_fn = None
+        else:
+            # otherwise, attach to the prison right in the forked
+            # child, saving an extra exec of jexec
+            jexec_args = ()
+            preexec_fn = get_jail_attacher(self._jid)
+
+        args = (
             # jexec
-            JEXEC_CMD,
-            *user_args,
-            str(self._jid),
+            *jexec_args,
 
             # env
             '/usr/bin/env',
@@ -65,15 +83,20 @@ class Prison(Resource):
             # so we need to explicitly define common vars like HOME below;
             '-i',
             # XXX: should be changed to -L- when 12.x is gone
-            '-L', str(pwd.getpwnam(user).pw_uid if user is not None else 0),
+            '-L', str(_get_uid(user) if user is not None else 0),
             'HOME=/nonexistent',
             'SHELL=/bin/sh',
             *((f'TERM={term}',) if (term := os.environ.get('term')) else ()),
             f'USER={user if user else "root"}',
+        )
 
-            # program
-            program, *args,
-        ]
+        self._command_prefixes[user] = prefix = (args, preexec_fn)
+        return prefix
+
+    async def execute_by_line(self, program: str, *args: Any, log: TextIO | None, user: str | None = None) -> int:
+        prefix_args, preexec_fn = self._get_command_prefix(user)
+
+        full_args = [*prefix_args, program, *args]
 
         logging.getLogger('Execute').debug('executing ' + ' '.join(full_args))
 
@@ -84,6 +107,7 @@ class Prison(Resource):
             stdin=asyncio.subprocess.DEVNULL,
             stdout=log,
             stderr=log,
+            preexec_fn=preexec_fn,
         )
 
         await proc.communicate()
@@ -96,20 +120,17 @@ class Prison(Resource):
     async def destroy(self) -> None:
         _logger.debug(f'destroying prison {self._jid}')
         await execute(JAIL_CMD, '-r', str(self._jid))
+
+        # jail usually dies almost immediately, and as the check is a
+        # cheap syscall, poll often at first, backing off gradually
+        delay = _DESTROY_POLL_MIN_INTERVAL
         while await self.is_running():
-            logging.debug('waiting for prison {self._jid} to die')
-            await asyncio.sleep(1)
+            _logger.debug(f'waiting for prison {self._jid} to die')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _DESTROY_POLL_MAX_INTERVAL)
 
     async def is_running(self) -> bool:
-        proc = await asyncio.create_subprocess_exec(
-            JLS_CMD, '-j', str(self._jid),
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL
-        )
-
-        await proc.communicate()
-
-        return proc.returncode == 0
+        return jail_exists(self._jid)
 
     def get_path(self) -> Path:
         return self._path
@@ -19,24 +19,28 @@ from __future__ import annotations
 
 import asyncio
 import datetime
+import json
 import logging
 import os
 import pickle
 import sys
+from array import array
 from dataclasses import asdict, dataclass
 from enum import Enum
+from functools import cached_property
 from pathlib import Path
+from typing import Any
 
 import aiohttp
-from jsonslicer import JsonSlicer
 
 from reprise.compat import dataclass_slots_arg
-from reprise.execute import execute
 from reprise.lock import file_lock
 from reprise.types import Port
 from reprise.workdir import Workdir
 
-_CHUNK_SIZE = 1024 * 64
+# network reads return whatever has arrived, usually much less than
+# requested, so writes are coalesced through a file buffer of this size
+_CHUNK_SIZE = 1024 * 1024
 
 
 @dataclass(frozen=True, **dataclass_slots_arg)
@@ -46,7 +50,7 @@ class PackageInfo:
     origin: str
     size: int
     flavor: str | None
-    deps: list[str] | None
+    deps: tuple[str, ...]
 
     @property
     def namever(self) -> str:
@@ -69,47 +73,168 @@ class Package(PackageInfo):
     path: Path
 
 
-_REPOSITORY_METADATA_VERSION = 1
+# metadata is pickled as columns of builtin types, which,
+# unlike pickled dataclasses, does not depend on python version;
+# etag and update time are stored separately in a small header
+_REPOSITORY_METADATA_VERSION = 4
 
 
-_REPOSITORY_METADATA_TAG = f'{_REPOSITORY_METADATA_VERSION}/py{sys.version_info.major}.{sys.version_info.minor}'
+_REPOSITORY_METADATA_TAG = f'{_REPOSITORY_METADATA_VERSION}'
 
 
 class BadRepositoryMetadataVersion(RuntimeError):
     pass
 
 
+def _write_file_atomically(path: Path, data: bytes) -> None:
+    temp_path = path.with_name(path.name + '.new')
+
+    with open(temp_path, 'wb') as fd:
+        fd.write(data)
+        fd.flush()
+        os.fsync(fd.fileno())
+
+    temp_path.replace(path)
+
+
 class _RepositoryMetadata:
     etag: str
     last_update: datetime.datetime
-    packages: list[PackageInfo]
 
-    # XXX: we may optimize by not pickling these: implement __getstate__/__setstate__
-    by_name: dict[str, PackageInfo]
-    by_namever: dict[str, PackageInfo]
-    by_port: dict[Port, PackageInfo]
+    # packages are stored by columns, and PackageInfo objects are only
+    # created for packages which are actually looked up, so loading
+    # is mostly unpickling a few lists of builtin objects
+    _names: list[str]
+    _versions: list[str]
+    _origins: list[str]
+    _sizes: array[int]
+    _flavors: list[str | None]
+    _deps: list[tuple[str, ...]]
+
+    _packages: dict[int, PackageInfo]
 
     def __init__(self, etag: str, last_update: datetime.datetime, packages: list[PackageInfo]) -> None:
         self.etag = etag
         self.last_update = last_update
-        self.packages = packages
 
-        self._update_dicts()
-
-    def __getstate__(self) -> tuple[str, str, datetime.datetime, list[PackageInfo]]:
-        return (_REPOSITORY_METADATA_TAG, self.etag, self.last_update, self.packages)
-
-    def __setstate__(self, state: tuple[str, str, datetime.datetime, list[PackageInfo]]) -> None:
+        self._names = [package.name for package in packages]
+        self._versions = [package.version for package in packages]
+        self._origins = [package.origin for package in packages]
+        self._sizes = array('Q', [package.size for package in packages])
+        self._flavors = [package.flavor for package in packages]
+        self._deps = [package.deps for package in packages]
+
+        self._packages = {}
+
+    def __getstate__(self) -> tuple[Any, ...]:
+        return (
+            _REPOSITORY_METADATA_TAG,
+            self._names,
+            self._versions,
+            self._origins,
+            self._sizes.tobytes(),
+            self._flavors,
+            self._deps,
+        )
+
+    def __setstate__(self, state: tuple[Any, ...]) -> None:
         tag, *rest = state
         if tag != _REPOSITORY_METADATA_TAG:
             raise BadRepositoryMetadataVersion(f'repository metadata tag mismatch: {tag} != {_REPOSITORY_METADATA_TAG}')
-        self.etag, self.last_update, self.packages = rest  # type: ignore  # mypy cannot guess the type of `rest`
-        self._update_dicts()
+        self._names, self._versions, self._origins, sizes, self._flavors, self._deps = rest
+        self._sizes = array('Q', sizes)
+        self._packages = {}
 
-    def _update_dicts(self) -> None:
-        self.by_name = {package.name: package for package in self.packages}
-        self.by_namever = {package.namever: package for package in self.packages}
-        self.by_port = {package.port: package for package in self.packages}
+    def _get_package(self, index: int | None) -> PackageInfo | None:
+        if index is None:
+            return None
+
+        if (package := self._packages.get(index)) is None:
+            package = PackageInfo(
+                self._names[index],
+                self._versions[index],
+                self._origins[index],
+                self._sizes[index],
+                self._flavors[index],
+                self._deps[index],
+            )
+            self._packages[index] = package
+
+        return package
+
+    # indexes are built on first use, as not all of them are needed
+    @cached_property
+    def _index_by_name(self) -> dict[str, int]:
+        return {name: index for index, name in enumerate(self._names)}
+
+    @cached_property
+    def _index_by_namever(self) -> dict[str, int]:
+        return {f'{name}-{version}': index for index, (name, version) in enumerate(zip(self._names, self._versions))}
+
+    @cached_property
+    def _index_by_port(self) -> dict[Port, int]:
+        return {Port(origin, flavor): index for index, (origin, flavor) in enumerate(zip(self._origins, self._flavors))}
+
+    def get_by_name(self, name: str) -> PackageInfo | None:
+        return self._get_package(self._index_by_name.get(name))
+
+    def get_by_namever(self, namever: str) -> PackageInfo | None:
+        return self._get_package(self._index_by_namever.get(namever))
+
+    def get_by_port(self, port: Port) -> PackageInfo | None:
+        return self._get_package(self._index_by_port.get(port))
+
+
+def _parse_package(line: bytes) -> PackageInfo:
+    item = json.loads(line)
+    flavor = item.get('annotations', {}).get('flavor')
+
+    # origins, flavors and dependency names are repeated a lot over
+    # the repository, interning lets them share storage both in
+    # memory and in pickled metadata; positional arguments are
+    # used as this is run for every package in the repository
+    return PackageInfo(
+        sys.intern(item['name']),
+        item['version'],
+        sys.intern(item['origin']),
+        item['pkgsize'],
+        None if flavor is None else sys.intern(flavor),
+        tuple(map(sys.intern, item.get('deps', {}))),
+    )
+
+
+async def _extract_packagesite(response: aiohttp.ClientResponse) -> bytes:
+    # the archive may use any compression supported by pkg, so leave
+    # extraction to tar, feeding it the data as it's being downloaded
+    proc = await asyncio.create_subprocess_exec(
+        'tar', '-x', '-O', '-f', '-', 'packagesite.yaml',
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+    async def feed() -> None:
+        assert proc.stdin is not None
+        try:
+            async for chunk in response.content.iter_chunked(_CHUNK_SIZE):
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # tar has failed, which is reported below
+        finally:
+            proc.stdin.close()
+
+    assert proc.stdout is not None
+    assert proc.stderr is not None
+
+    # communicate() is not used, as since python 3.12 it closes
+    # stdin regardless of input, cutting the feed short
+    _, packagesite_yaml, stderr = await asyncio.gather(feed(), proc.stdout.read(), proc.stderr.read())
+
+    if await proc.wait() != 0:
+        raise RuntimeError(f'failed to extract repository metadata: {stderr.decode("utf-8")}')
+
+    return packagesite_yaml
 
 
 class Repository:
@@ -122,9 +247,15 @@ class Repository:
 
     _metadata: _RepositoryMetadata | None
 
+    _present_packages: set[str]
     _inflight_fetches: set[str]
     _fetch_event: asyncio.Event
 
+    _update_task: asyncio.Task[None] | None
+    _update_task_forced: bool
+
+    _session: aiohttp.ClientSession | None
+
     def __init__(self, release: int, arch: str, path: Path, url: str, system: str, branch: str) -> None:
         abi = f'{system}:{release}:{arch}'
 
@@ -139,18 +270,44 @@ class Repository:
 
         path.mkdir(parents=True, exist_ok=True)
 
+        # one directory scan instead of a stat for each requested package;
+        # packages may also be fetched by other instances meanwhile, so
+        # a miss still needs to be checked against the filesystem
+        self._present_packages = {entry.name for entry in os.scandir(path) if entry.name.endswith('.pkg')}
         self._inflight_fetches = set()
         self._fetch_event = asyncio.Event()
 
+        self._update_task = None
+        self._update_task_forced = False
+
+        self._session = None
+
         self._metadata = None
 
         try:
             self._logger.debug('loading metadata')
+            with open(self._path / 'packagesite.json', 'rb') as fd:
+                header = json.load(fd)
             with open(self._path / 'packagesite.pickle', 'rb') as fd:
-                self._metadata = pickle.load(fd)
-        except (FileNotFoundError, pickle.UnpicklingError, BadRepositoryMetadataVersion) as e:
+                metadata = pickle.load(fd)
+            metadata.etag = header['etag']
+            metadata.last_update = datetime.datetime.fromisoformat(header['last_update'])
+            self._metadata = metadata
+        except (FileNotFoundError, KeyError, ValueError, pickle.UnpicklingError, BadRepositoryMetadataVersion) as e:
             self._logger.error(f'loading metadata failed ({e}), forced update required')
 
+    def _get_session(self) -> aiohttp.ClientSession:
+        # shared by all requests to reuse connections; created
+        # lazily, as it needs to be bound to the running event loop
+        if self._session is None:
+            self._session = aiohttp.ClientSession(raise_for_status=True)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
     def _get_base_url(self) -> str:
         return f'{self._url}/{self._abi}/{self._branch}'
 
@@ -166,94 +323,120 @@ class Repository:
         return datetime.datetime.now() - self._metadata.last_update
 
     async def update(self, force: bool = False) -> None:
+        # concurrent callers share a single update, owned by the caller
+        # which started it; others wait on it shielded, so a cancelled
+        # waiter does not abort it for the rest
+        while (task := self._update_task) is not None and not task.done():
+            if self._update_task_forced or not force:
+                self._logger.debug('waiting for update running in another task')
+                try:
+                    await asyncio.shield(task)
+                    return
+                except asyncio.CancelledError:
+                    # the owner was cancelled, so run our own update
+                    if not task.cancelled():
+                        raise
+                    continue
+
+            # non-forced update may find metadata unchanged and skip
+            # the download, so it cannot satisfy a forced one
+            self._logger.debug('waiting for update running in another task before forced update')
+            await asyncio.wait([task])
+
+        self._update_task = asyncio.create_task(self._update(force))
+        self._update_task_forced = force
+
+        await self._update_task
+
+    async def _update(self, force: bool) -> None:
         packagesite_url = self._get_base_url() + '/packagesite.pkg'
 
-        packagesite_pkg_path = self._path / 'packagesite.pkg'
-        packagesite_yaml_path = self._path / 'packagesite.yaml'
         packagesite_pickle_path = self._path / 'packagesite.pickle'
+        packagesite_header_path = self._path / 'packagesite.json'
 
         self._logger.debug('updating metadata')
 
-        async with aiohttp.ClientSession(raise_for_status=True) as session:
-            if self._metadata and not force:
-                self._logger.debug('checking if update is needed')
-                async with session.head(packagesite_url) as response:
-                    if self._metadata.etag == response.headers.get('etag'):
-                        self._logger.debug('repository metadata has not changed')
-                        return
-
-            async with session.get(packagesite_url) as response:
-                self._logger.debug('fetching repository metadata')
-                with open(packagesite_pkg_path, 'wb') as fd:
-                    async for chunk in response.content.iter_chunked(_CHUNK_SIZE):
-                        fd.write(chunk)
+        headers = {}
+        if self._metadata and self._metadata.etag and not force:
+            # conditional request: if etag still matches, the
+            # server replies with 304 Not Modified without a body
+            headers['If-None-Match'] = self._metadata.etag
 
-                etag = response.headers.get('etag', '')
+        async with self._get_session().get(packagesite_url, headers=headers) as response:
+            if response.status == 304:
+                assert self._metadata is not None
+                self._logger.debug('repository metadata has not changed')
+                self._metadata.last_update = datetime.datetime.now()
+                self._save_metadata_header(packagesite_header_path)
+                return
 
-        self._logger.debug('extracting metadata')
-        await execute('tar', '-x', '-f', 'packagesite.pkg', 'packagesite.yaml', cwd=self._path)
+            self._logger.debug('fetching and extracting repository metadata')
+            packagesite_yaml = await _extract_packagesite(response)
 
-        packagesite_pkg_path.unlink()
+            etag = response.headers.get('etag', '')
 
         self._logger.debug('parsing metadata')
-        with open(packagesite_yaml_path) as fd:
-            packages = []
-            for item in JsonSlicer(fd, (), yajl_allow_multiple_values=True):
-                packages.append(PackageInfo(
-                    name=item['name'],
-                    version=item['version'],
-                    origin=item['origin'],
-                    size=item['pkgsize'],
-                    flavor=item.get('annotations', {}).get('flavor'),
-                    deps=list(item.get('deps', {}).keys()) or None,
-                ))
-
-            self._metadata = _RepositoryMetadata(
-                etag=etag,
-                last_update=datetime.datetime.now(),
-                packages=packages
-            )
+        # the file is a sequence of JSON objects, one per line; it's
+        # small enough to be processed in memory, and parsing each line
+        # as a whole is much faster than streaming parser
+        packages = [_parse_package(line) for line in packagesite_yaml.splitlines()]
 
-        packagesite_yaml_path.unlink()
+        self._metadata = _RepositoryMetadata(
+            etag=etag,
+            last_update=datetime.datetime.now(),
+            packages=packages
+        )
 
         self._logger.debug('saving metadata')
-        with open(packagesite_pickle_path.with_suffix('.new'), 'wb') as fd:
-            pickle.dump(self._metadata, fd)
-            fd.flush()
-            os.fsync(fd.fileno())
+        _write_file_atomically(packagesite_pickle_path, pickle.dumps(self._metadata))
 
-        packagesite_pickle_path.with_suffix('.new').replace(packagesite_pickle_path)
+        # header goes last, so it never refers to packages not yet saved
+        self._save_metadata_header(packagesite_header_path)
+
+    def _save_metadata_header(self, path: Path) -> None:
+        assert self._metadata is not None
+        header = {
+            'etag': self._metadata.etag,
+            'last_update': self._metadata.last_update.isoformat(),
+        }
+        _write_file_atomically(path, json.dumps(header).encode('utf-8'))
 
     def get_package_info_by_port(self, port: Port) -> PackageInfo | None:
         if self._metadata is None:
             raise RuntimeError('attempt to access uninitialized repository')
-        return self._metadata.by_port.get(port)
+        return self._metadata.get_by_port(port)
 
     def get_package_info_by_name(self, name: str) -> PackageInfo | None:
         if self._metadata is None:
             raise RuntimeError('attempt to access uninitialized repository')
-        return self._metadata.by_name.get(name)
+        return self._metadata.get_by_name(name)
 
     def get_package_info_by_namever(self, namever: str) -> PackageInfo | None:
         if self._metadata is None:
             raise RuntimeError('attempt to access uninitialized repository')
-        return self._metadata.by_namever.get(namever)
+        return self._metadata.get_by_namever(namever)
 
     async def get_package(self, package_info: PackageInfo) -> Package:
         package_path = self._path / package_info.filename
 
         res = Package(**asdict(package_info), path=package_path)
 
-        if package_path.exists():
+        if package_info.filename in self._present_packages:
             self._logger.debug(f'package {package_info.filename} already fetched')
             return res
 
+        if package_path.exists():
+            self._logger.debug(f'package {package_info.filename} already fetched by another instance')
+            self._present_packages.add(package_info.filename)
+            return res
+
         if package_info.filename in self._inflight_fetches:
             # wait till some other task fetches it for us
             while package_info.filename in self._inflight_fetches:
                 self._logger.debug(f'waiting for another task to fetch package {package_info.filename}')
+                self._fetch_event.clear()
                 await self._fetch_event.wait()
-            if package_path.exists():
+            if package_info.filename in self._present_packages:
                 self._logger.debug(f'package {package_info.filename} fetched by another task successfully')
                 return res
             else:
@@ -265,14 +448,14 @@ class Repository:
         try:
             package_url = self._get_base_url() + '/All/' + package_info.filename
 
-            async with aiohttp.ClientSession(raise_for_status=True) as session:
-                with open(package_path.with_suffix('.tmp'), 'wb') as fd:
-                    async with session.get(package_url) as response:
-                        async for chunk in response.content.iter_chunked(_CHUNK_SIZE):
-                            fd.write(chunk)
-                    fd.flush()
-                    os.fsync(fd.fileno())
-                package_path.with_suffix('.tmp').replace(package_path)
+            with open(package_path.with_suffix('.tmp'), 'wb', buffering=_CHUNK_SIZE) as fd:
+                async with self._get_session().get(package_url) as response:
+                    async for chunk in response.content.iter_chunked(_CHUNK_SIZE):
+                        fd.write(chunk)
+                fd.flush()
+                os.fsync(fd.fileno())
+            package_path.with_suffix('.tmp').replace(package_path)
+            self._present_packages.add(package_info.filename)
 
             self._logger.debug(f'package {package_info.filename} fetched successfully')
             return res
@@ -314,7 +497,7 @@ class RepositoryManager:
         if key not in self._repositories:
             self._logger.debug(f'initializing {key}')
 
-            with file_lock(path / 'lock'):
+            async with file_lock(path / 'lock'):
                 repository = Repository(
                     url=url,
                     release=release,
@@ -324,23 +507,31 @@ class RepositoryManager:
                     branch=branch,
                 )
 
-                if self._update_mode == RepositoryUpdateMode.FORCE:
-                    self._logger.debug(f'forcing update of repository {key}')
-                    await repository.update(force=True)
-                elif self._update_mode == RepositoryUpdateMode.AUTO:
-                    age = repository.get_update_age()
-                    if self._update_period is not None and age is not None and age < self._update_period:
-                        self._logger.debug(f'skipping update of repository {key} based on age')
+                try:
+                    if self._update_mode == RepositoryUpdateMode.FORCE:
+                        self._logger.debug(f'forcing update of repository {key}')
+                        await repository.update(force=True)
+                    elif self._update_mode == RepositoryUpdateMode.AUTO:
+                        age = repository.get_update_age()
+                        if self._update_period is not None and age is not None and age < self._update_period:
+                            self._logger.debug(f'skipping update of repository {key} based on age')
+                        else:
+                            self._logger.debug(f'running update of repository {key}')
+                            await repository.update()
                     else:
-                        self._logger.debug(f'running update of repository {key}')
-                        await repository.update()
-                else:
-                    self._logger.debug(f'update of repository {key} is disabled')
+                        self._logger.debug(f'update of repository {key} is disabled')
 
-                if not repository.is_initialized():
-                    self._logger.error(f'repository {key} is not initialized, cannot continue')
-                    raise RuntimeError(f'repository {key} is not initialized, cannot continue')
+                    if not repository.is_initialized():
+                        self._logger.error(f'repository {key} is not initialized, cannot continue')
+                        raise RuntimeError(f'repository {key} is not initialized, cannot continue')
+                except BaseException:
+                    # not registered, so close() won't get to its session
+                    await repository.close()
+                    raise
 
                 self._repositories[key] = repository
 
         return self._repositories[key]
+
+    async def close(self) -> None:
+        await asyncio.gather(*(repository.close() for repository in self._repositories.values()))
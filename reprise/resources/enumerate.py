@@ -15,24 +15,25 @@
 # You should have received a copy of the GNU General Public License
 # along with reprise.  If not, see <http://www.gnu.org/licenses/>.
 
-import asyncio
-import json
 from pathlib import Path
 
-from reprise.commands import JLS_CMD, MOUNT_CMD
-from reprise.execute import execute
+from reprise.libc import get_jails, get_mounts
 from reprise.mount import Mountpoint
 from reprise.prison import Prison
 from reprise.resources import Resource
 from reprise.zfs import ZFS
 
 
-async def enumerate_mountpoints(prefix: Path) -> list[Resource]:
-    res: list[Resource] = []
+def _sorted_by_path(resources: list[Resource]) -> list[Resource]:
+    # reverse order places nested resources before their parents; sort key
+    # is computed once per item, and strings compare much faster than paths
+    return sorted(resources, key=lambda resource: str(resource.get_path()), reverse=True)
+
 
-    for line in await execute(MOUNT_CMD, '-p'):
-        src, dst, fstype, *_ = line.strip().split()
+def enumerate_mountpoints(prefix: Path) -> list[Resource]:
+    res: list[Resource] = []
 
+    for src, dst, fstype in get_mounts():
         if fstype == 'zfs':
             dataset = Path(src)
             mountpoint = Path(dst)
@@ -43,28 +44,21 @@ async def enumerate_mountpoints(prefix: Path) -> list[Resource]:
             if mountpoint.is_relative_to(prefix):
                 res.append(Mountpoint(mountpoint))
 
-    return sorted(res, key=lambda res: res.get_path(), reverse=True)
+    return _sorted_by_path(res)
 
 
-async def enumerate_jails(prefix: Path) -> list[Resource]:
-    jails_info = json.loads((await execute(JLS_CMD, '-n', '--libxo', 'json'))[0])
-
-    res = []
+def enumerate_jails(prefix: Path) -> list[Resource]:
+    res: list[Resource] = []
 
-    for jail_info in jails_info['jail-information']['jail']:
-        jid = int(jail_info['jid'])
-        path = Path(jail_info['path'])
+    for jid, path_str in get_jails():
+        path = Path(path_str)
 
         if path.is_relative_to(prefix):
             res.append(Prison(jid, path))
 
-    return sorted(res, key=lambda res: res.get_path(), reverse=True)
-
+    return _sorted_by_path(res)
 
-async def enumerate_resources(prefix: Path) -> list[Resource]:
-    mountpoints, jails = await asyncio.gather(
-        enumerate_mountpoints(prefix),
-        enumerate_jails(prefix),
-    )
 
-    return jails + mountpoints
+def enumerate_resources(prefix: Path) -> list[Resource]:
+    # these are plain syscalls, so there's no point in running them concurrently
+    return enumerate_jails(prefix) + enumerate_mountpoints(prefix)
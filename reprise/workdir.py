@@ -17,6 +17,7 @@
 
 from __future__ import annotations
 
+import asyncio
 import logging
 from pathlib import Path
 
@@ -70,10 +71,19 @@ class Workdir:
             workdir.get_ccache(),
         ]
 
-        for filesystem in required_filesystems:
-            if not await filesystem.exists():
-                logger.debug(f'creating missing child dataset {filesystem}')
-                await filesystem.create()
+        # a single listing answers existence for all children at once
+        existing_filesystems = set(await root.get_children())
+
+        missing_filesystems = [
+            filesystem
+            for filesystem in required_filesystems
+            if filesystem.get_name() not in existing_filesystems
+        ]
+
+        for filesystem in missing_filesystems:
+            logger.debug(f'creating missing child dataset {filesystem}')
+
+        await asyncio.gather(*(filesystem.create() for filesystem in missing_filesystems))
 
         return workdir
 
@@ -25,15 +25,30 @@ from reprise.commands import ZFS_CMD, ZPOOL_CMD
 from reprise.execute import execute
 from reprise.resources import Resource
 
+_GET_ARGS = ('-H', '-p', '-o')
+_LIST_ARGS = ('-H', '-p')
+_LIST_RECURSIVE_ARGS = ('-r',)
+_LIST_CHILDREN_ARGS = ('-d', '1')
+_FORCE_RECURSIVE_ARGS = ('-R', '-f')
 
-def _properties_to_args(properties: dict[str, str] | None) -> list[str]:
+_DESTROY_MAX_ATTEMPTS = 10
+_DESTROY_RETRY_MIN_INTERVAL = 0.05
+_DESTROY_RETRY_MAX_INTERVAL = 2.0
+
+
+def _properties_to_args(properties: dict[str, str] | None) -> tuple[str, ...]:
     if properties is None:
-        return []
-    return list(sum((['-o', f'{k}={v}'] for k, v in properties.items()), []))
+        return ()
+    return tuple(arg for k, v in properties.items() for arg in ('-o', f'{k}={v}'))
+
+
+def _optional_args(*args: tuple[str, bool]) -> tuple[str, ...]:
+    return tuple(arg for arg, enabled in args if enabled)
 
 
-def _optional_args(*args: tuple[str, bool]) -> list[str]:
-    return [arg for arg, enabled in args if enabled]
+def _depth_args(recursive: bool) -> tuple[str, ...]:
+    # let zfs skip grandchildren instead of listing and filtering them out
+    return _LIST_RECURSIVE_ARGS if recursive else _LIST_CHILDREN_ARGS
 
 
 async def get_zfs_pools() -> list[str]:
@@ -42,10 +57,12 @@ async def get_zfs_pools() -> list[str]:
 
 class ZFS(Resource):
     _dataset: Path
+    _dataset_str: str
     _mountpoint: Path | None
 
     def __init__(self, dataset: Path, mountpoint: Path | None = None) -> None:
         self._dataset = dataset
+        self._dataset_str = str(dataset)
         self._mountpoint = mountpoint
 
     def __repr__(self) -> str:
@@ -54,72 +71,78 @@ class ZFS(Resource):
     def get_child(self, subpath: str | Path) -> 'ZFS':
         return ZFS(self._dataset / subpath, self._mountpoint / subpath if self._mountpoint is not None else None)
 
+    def get_name(self) -> str:
+        return self._dataset_str
+
     def get_path(self) -> Path:
         if self._mountpoint is None:
             raise RuntimeError('attempt to query unknown mountpoint')
         return self._mountpoint
 
     async def get_property(self, propname: str) -> str:
-        result = await execute(ZFS_CMD, 'get', '-H', '-p', '-o', 'value', propname, f'{self._dataset}')
+        result = await execute(ZFS_CMD, 'get', *_GET_ARGS, 'value', propname, self._dataset_str)
         return result[0]
 
     async def get_property_maybe(self, propname: str) -> str | None:
-        result = await execute(ZFS_CMD, 'get', '-H', '-p', '-o', 'value', propname, f'{self._dataset}', allow_failure=True)
+        result = await execute(ZFS_CMD, 'get', *_GET_ARGS, 'value', propname, self._dataset_str, allow_failure=True)
         return result[0] if result else None
 
+    async def get_properties_maybe(self, propnames: list[str]) -> dict[str, str]:
+        result = await execute(ZFS_CMD, 'get', *_GET_ARGS, 'property,value', ','.join(propnames), self._dataset_str, allow_failure=True)
+        return dict(line.split('\t', 1) for line in result)
+
     async def set_property(self, propname: str, propvalue: str) -> None:
-        await execute(ZFS_CMD, 'set', propname + '=' + propvalue, f'{self._dataset}')
+        await execute(ZFS_CMD, 'set', propname + '=' + propvalue, self._dataset_str)
+
+    async def set_properties(self, properties: dict[str, str]) -> None:
+        await execute(ZFS_CMD, 'set', *(f'{k}={v}' for k, v in properties.items()), self._dataset_str)
 
     async def resolve_mountpoint(self) -> None:
-        mountpoint, mounted = await asyncio.gather(
-            self.get_property_maybe('mountpoint'),
-            self.get_property_maybe('mounted')
-        )
+        properties = await self.get_properties_maybe(['mountpoint', 'mounted'])
+        mountpoint, mounted = properties.get('mountpoint'), properties.get('mounted')
         if mountpoint is not None and mountpoint.startswith('/') and mounted == 'yes':
             self._mountpoint = Path(mountpoint)
 
     async def exists(self) -> bool:
-        return await self.get_property_maybe('name') is not None
+        return bool(await execute(ZFS_CMD, 'list', '-H', '-o', 'name', self._dataset_str, allow_failure=True))
 
     async def create(self, parents: bool = False, properties: dict[str, str] | None = None) -> None:
-        await execute(ZFS_CMD, 'create', *_optional_args(('-p', parents)), *_properties_to_args(properties), f'{self._dataset}')
+        await execute(ZFS_CMD, 'create', *_optional_args(('-p', parents)), *_properties_to_args(properties), self._dataset_str)
 
     async def destroy(self) -> None:
-        while True:
+        delay = _DESTROY_RETRY_MIN_INTERVAL
+        for attempt in range(_DESTROY_MAX_ATTEMPTS):
             try:
-                await execute(ZFS_CMD, 'destroy', '-R', '-f', f'{self._dataset}')
+                await execute(ZFS_CMD, 'destroy', *_FORCE_RECURSIVE_ARGS, self._dataset_str)
                 return
             except RuntimeError as e:
+                if attempt == _DESTROY_MAX_ATTEMPTS - 1:
+                    raise
                 logging.error(e)
-                await asyncio.sleep(1)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, _DESTROY_RETRY_MAX_INTERVAL)
 
     async def snapshot(self, snapshot: str, recursive: bool = False) -> None:
-        await execute(ZFS_CMD, 'snapshot', *_optional_args(('-r', recursive)), f'{self._dataset}@{snapshot}')
+        await execute(ZFS_CMD, 'snapshot', *_optional_args(('-r', recursive)), f'{self._dataset_str}@{snapshot}')
 
     async def rollback(self, snapshot: str) -> None:
-        await execute(ZFS_CMD, 'rollback', '-R', '-f', f'{self._dataset}@{snapshot}')
+        await execute(ZFS_CMD, 'rollback', *_FORCE_RECURSIVE_ARGS, f'{self._dataset_str}@{snapshot}')
 
     async def clone_from(self, source: 'ZFS', snapshot: str, parents: bool = False) -> None:
-        await execute(ZFS_CMD, 'clone', *_optional_args(('-p', parents)), f'{source._dataset}@{snapshot}', f'{self._dataset}')
+        await execute(ZFS_CMD, 'clone', *_optional_args(('-p', parents)), f'{source._dataset_str}@{snapshot}', self._dataset_str)
 
     async def destroy_snapshot(self, snapshot: str) -> None:
-        await execute(ZFS_CMD, 'destroy', f'{self._dataset}@{snapshot}')
+        await execute(ZFS_CMD, 'destroy', f'{self._dataset_str}@{snapshot}')
 
     async def get_children(self, recursive: bool = False) -> list[str]:
-        lines = await execute(ZFS_CMD, 'list', '-H', '-p', '-r', '-o', 'name', f'{self._dataset}', allow_failure=True)
+        lines = await execute(ZFS_CMD, 'list', *_LIST_ARGS, *_depth_args(recursive), '-o', 'name', self._dataset_str, allow_failure=True)
 
-        return [line for line in lines if (depth := line.count('/')) >= 1 and (recursive or depth <= 1)]
+        # the listing starts with the dataset itself
+        return lines[1:]
 
     async def get_children_properties(self, recursive: bool = False, properties: list[str] | None = None) -> list[list[str]]:
         properties_arg = ','.join(['name'] + (properties if properties is not None else []))
 
-        lines = await execute(ZFS_CMD, 'list', '-H', '-p', '-r', '-o', properties_arg, f'{self._dataset}', allow_failure=True)
-        result = []
-
-        for line in lines:
-            name, *values = line.split('\t')
-            depth = name.count('/')
-            if depth >= 1 and (recursive or depth <= 1):
-                result.append(values)
+        lines = await execute(ZFS_CMD, 'list', *_LIST_ARGS, *_depth_args(recursive), '-o', properties_arg, self._dataset_str, allow_failure=True)
 
-        return result
+        return [line.split('\t')[1:] for line in lines[1:]]
@@ -46,7 +46,7 @@ setup(
         'Topic :: System :: Archiving :: Packaging',
     ],
     python_requires='>=3.9',
-    install_requires=['aiohttp', 'jsonslicer>=0.1.7', 'termcolor>=1.1.0'],
+    install_requires=['aiohttp', 'termcolor>=1.1.0'],
     packages=find_packages(include=['reprise*']),
     entry_points={
         'console_scripts': ['reprise=reprise.cli:main']
@@ -0,0 +1,89 @@
+# Copyright (C) 2022 Dmitry Marakasov <amdmi3@amdmi3.ru>
+#
+# This file is part of reprise
+#
+# reprise is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# reprise is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with reprise.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+from pathlib import Path
+from typing import Any, AsyncGenerator
+
+import pytest
+
+from reprise.zfs import ZFS
+
+_ENVNAME = 'REPRISE_TEST_ZFS_POOL'
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addoption('--zfs-keep', action='store_true', help='keep test ZFS datasets after the run and reuse them in the next one')
+
+
+@pytest.fixture(scope='session')
+def zfs_keep(pytestconfig: pytest.Config) -> bool:
+    return bool(pytestconfig.getoption('zfs_keep'))
+
+
+@pytest.fixture
+def spawned_processes(monkeypatch: pytest.MonkeyPatch) -> list[tuple[Any, ...]]:
+    # records arguments of every subprocess spawned during the test
+    spawned: list[tuple[Any, ...]] = []
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def spy(*args: Any, **kwargs: Any) -> Any:
+        spawned.append(args)
+        return await create_subprocess_exec(*args, **kwargs)
+
+    monkeypatch.setattr(asyncio, 'create_subprocess_exec', spy)
+
+    return spawned
+
+
+@pytest.fixture(scope='session')
+def zfs_pool() -> Path:
+    pool = os.environ.get(_ENVNAME)
+    if pool is None:
+        pytest.skip('no test ZFS pool defined with REPRISE_TEST_ZFS_POOL environment variable')
+    else:
+        return Path(pool)
+
+
+@pytest.fixture(scope='session')
+async def zfs(zfs_pool, zfs_keep: bool) -> AsyncGenerator[Any, ZFS]:
+    # provide a dedicated dataset at the root of the pool
+    # for the test session and clean it up after use, unless
+    # asked to keep it for the next run
+    zfs = ZFS(zfs_pool).get_child('reprise_test')
+
+    exists = await zfs.exists()
+
+    if exists and not zfs_keep:
+        await zfs.destroy()
+        exists = False
+    elif exists:
+        # an interrupted run may have left children behind
+        await asyncio.gather(*(ZFS(Path(name)).destroy() for name in await zfs.get_children()))
+
+    if not exists:
+        await zfs.create()
+
+    exists, _ = await asyncio.gather(zfs.exists(), zfs.resolve_mountpoint())
+    assert exists
+
+    yield zfs
+
+    if not zfs_keep:
+        await zfs.destroy()
+        assert not await zfs.exists()
@@ -34,27 +34,27 @@ class _FakePortsTree:
     port_path: Path
 
 
-@pytest.fixture
-def portstree(tmp_path) -> _FakePortsTree:
+# tests only read the tree, so it can be shared
+@pytest.fixture(scope='session')
+def portstree(tmp_path_factory) -> _FakePortsTree:
+    tmp_path = tmp_path_factory.mktemp('portstree')
     port_path = tmp_path / 'catname' / 'portname'
     distdir = Path('/distfiles')
 
     port_path.mkdir(parents=True)
 
-    with open(port_path / 'Makefile', 'w') as fd:
-        fd.write(f"""
-            PORTNAME=portname
+    (port_path / 'Makefile').write_text(f"""
+        PORTNAME=portname
 
-            PORTSDIR={tmp_path}  # set by ports framework in real life
-            DISTDIR={distdir}  # set by ports framework in real life
-        """)
+        PORTSDIR={tmp_path}  # set by ports framework in real life
+        DISTDIR={distdir}  # set by ports framework in real life
+    """)
 
     # root portstree Makefile
-    with open(tmp_path / 'Makefile', 'w') as fd:
-        fd.write(f"""
-            PORTSDIR={tmp_path}  # set by ports framework in real life
-            DISTDIR={distdir}  # set by ports framework in real life
-        """)
+    (tmp_path / 'Makefile').write_text(f"""
+        PORTSDIR={tmp_path}  # set by ports framework in real life
+        DISTDIR={distdir}  # set by ports framework in real life
+    """)
 
     return _FakePortsTree(
         portsdir=tmp_path,
@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with reprise.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import shutil
 
 import pytest
@@ -45,15 +46,14 @@ _PARAM_H = """
 
 
 @pytest.fixture
-def test_jail_path(tmp_path):
+async def test_jail_path(tmp_path):
     (tmp_path / 'etc').mkdir(parents=True)
     (tmp_path / 'usr/include/sys').mkdir(parents=True)
 
-    with open(tmp_path / 'etc/login.conf', 'x') as f:
-        f.write(_LOGIN_CONF)
-
-    with open(tmp_path / 'usr/include/sys/param.h', 'x') as f:
-        f.write(_PARAM_H)
+    await asyncio.gather(
+        asyncio.to_thread((tmp_path / 'etc/login.conf').write_text, _LOGIN_CONF),
+        asyncio.to_thread((tmp_path / 'usr/include/sys/param.h').write_text, _PARAM_H),
+    )
 
     return tmp_path
 
@@ -16,6 +16,8 @@
 # along with reprise.  If not, see <http://www.gnu.org/licenses/>.
 
 import shutil
+from pathlib import Path
+from typing import Any
 
 import pytest
 
@@ -23,6 +25,22 @@ from reprise.commands import MAKE_CMD
 from reprise.jobs.generate.options import (generate_options_combinations,
                                            get_port_options_vars)
 
+_PORT_PATH = Path('/nonexistent')
+
+
+@pytest.fixture
+def make_vars(monkeypatch) -> dict[str, str]:
+    # answer `make -V` queries from a dict instead of spawning make
+    # for the tests which are only concerned with combinations logic
+    variables: dict[str, str] = {}
+
+    async def fake_execute(program: str, *args: str, **kwargs: Any) -> list[str]:
+        return [variables.get(arg[2:], '') for arg in args if arg.startswith('-V')]
+
+    monkeypatch.setattr('reprise.jobs.generate.options.execute', fake_execute)
+
+    return variables
+
 
 @pytest.mark.skipif(not shutil.which(MAKE_CMD), reason=f'{MAKE_CMD} command required')
 async def test_error(tmp_path):
@@ -84,17 +102,15 @@ async def test_get_vars(tmp_path):
     }
 
 
-@pytest.mark.skipif(not shutil.which(MAKE_CMD), reason=f'{MAKE_CMD} command required')
-async def test_plain_options(tmp_path):
-    with open(tmp_path / 'Makefile', 'w') as fd:
-        fd.write("""
-            OPTIONS_DEFINE=O1 O2 O3 O4
-            OPTIONS_DEFAULT=O2 O4
-        """)
+async def test_plain_options(make_vars):
+    make_vars.update({
+        'OPTIONS_DEFINE': 'O1 O2 O3 O4',
+        'OPTIONS_DEFAULT': 'O2 O4',
+    })
 
     assert list(
         generate_options_combinations(
-            await get_port_options_vars(tmp_path),
+            await get_port_options_vars(_PORT_PATH),
             include_options=None,
             exclude_options=set(),
         )
@@ -106,18 +122,16 @@ async def test_plain_options(tmp_path):
     ]
 
 
-@pytest.mark.skipif(not shutil.which(MAKE_CMD), reason=f'{MAKE_CMD} command required')
-async def test_group_options(tmp_path):
-    with open(tmp_path / 'Makefile', 'w') as fd:
-        fd.write("""
-            OPTIONS_GROUP=G1
-            OPTIONS_GROUP_G1=O1 O2 O3 O4
-            OPTIONS_DEFAULT=O2 O4
-        """)
+async def test_group_options(make_vars):
+    make_vars.update({
+        'OPTIONS_GROUP': 'G1',
+        'OPTIONS_GROUP_G1': 'O1 O2 O3 O4',
+        'OPTIONS_DEFAULT': 'O2 O4',
+    })
 
     assert list(
         generate_options_combinations(
-            await get_port_options_vars(tmp_path),
+            await get_port_options_vars(_PORT_PATH),
             include_options=None,
             exclude_options=set(),
         )
@@ -134,18 +148,16 @@ async def test_group_options(tmp_path):
     ]
 
 
-@pytest.mark.skipif(not shutil.which(MAKE_CMD), reason=f'{MAKE_CMD} command required')
-async def test_single_options(tmp_path):
-    with open(tmp_path / 'Makefile', 'w') as fd:
-        fd.write("""
-            OPTIONS_SINGLE=S1
-            OPTIONS_SINGLE_S1=O1 O2 O3 O4
-            OPTIONS_DEFAULT=O2
-        """)
+async def test_single_options(make_vars):
+    make_vars.update({
+        'OPTIONS_SINGLE': 'S1',
+        'OPTIONS_SINGLE_S1': 'O1 O2 O3 O4',
+        'OPTIONS_DEFAULT': 'O2',
+    })
 
     assert list(
         generate_options_combinations(
-            await get_port_options_vars(tmp_path),
+            await get_port_options_vars(_PORT_PATH),
             include_options=None,
             exclude_options=set(),
         )
@@ -157,18 +169,16 @@ async def test_single_options(tmp_path):
     ]
 
 
-@pytest.mark.skipif(not shutil.which(MAKE_CMD), reason=f'{MAKE_CMD} command required')
-async def test_radio_options(tmp_path):
-    with open(tmp_path / 'Makefile', 'w') as fd:
-        fd.write("""
-            OPTIONS_RADIO=R1
-            OPTIONS_RADIO_R1=O1 O2 O3 O4
-            OPTIONS_DEFAULT=O2
-        """)
+async def test_radio_options(make_vars):
+    make_vars.update({
+        'OPTIONS_RADIO': 'R1',
+        'OPTIONS_RADIO_R1': 'O1 O2 O3 O4',
+        'OPTIONS_DEFAULT': 'O2',
+    })
 
     assert list(
         generate_options_combinations(
-            await get_port_options_vars(tmp_path),
+            await get_port_options_vars(_PORT_PATH),
             include_options=None,
             exclude_options=set(),
         )
@@ -182,18 +192,16 @@ async def test_radio_options(tmp_path):
     ]
 
 
-@pytest.mark.skipif(not shutil.which(MAKE_CMD), reason=f'{MAKE_CMD} command required')
-async def test_multi_options(tmp_path):
-    with open(tmp_path / 'Makefile', 'w') as fd:
-        fd.write("""
-            OPTIONS_MULTI=M1
-            OPTIONS_MULTI_M1=O1 O2 O3 O4 O5
-            OPTIONS_DEFAULT=O1 O2 O3
-        """)
+async def test_multi_options(make_vars):
+    make_vars.update({
+        'OPTIONS_MULTI': 'M1',
+        'OPTIONS_MULTI_M1': 'O1 O2 O3 O4 O5',
+        'OPTIONS_DEFAULT': 'O1 O2 O3',
+    })
 
     assert list(
         generate_options_combinations(
-            await get_port_options_vars(tmp_path),
+            await get_port_options_vars(_PORT_PATH),
             include_options=None,
             exclude_options=set(),
         )
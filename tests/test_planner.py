@@ -0,0 +1,31 @@
+# Copyright (C) 2022 Dmitry Marakasov <amdmi3@amdmi3.ru>
+#
+# This file is part of reprise
+#
+# reprise is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# reprise is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with reprise.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from reprise.plan.planner import _depend_to_port
+from reprise.types import Port
+
+
+@pytest.mark.parametrize('depend,port', [
+    ('foo>0:devel/foo', Port('devel/foo', None)),
+    ('foo>0:devel/foo@py39', Port('devel/foo', 'py39')),
+    ('${NONEXISTENT}:devel/foo:extract', Port('devel/foo', None)),
+    ('foo:devel/foo@py39:build', Port('devel/foo', 'py39')),
+])
+def test_depend_to_port(depend, port):
+    assert _depend_to_port(depend) == port
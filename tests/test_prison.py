@@ -15,42 +15,70 @@
 # You should have received a copy of the GNU General Public License
 # along with reprise.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import os
 import sys
 from pathlib import Path
+from typing import Any, AsyncGenerator, Awaitable
 
 import pytest
 
-from reprise.prison import NetworkingMode, start_prison
+from reprise.commands import JEXEC_CMD
+from reprise.prison import NetworkingMode, Prison, start_prison
 
+_ROOT = Path('/')
+_HOSTNAME = 'reprise_test_prison'
+_NONETWORK_HOSTNAME = 'reprise_test_prison_nonetwork'
+
+_UNREACHABLE_URLS = (
+    # expected to die with "Non-recoverable resolver failure"
+    'http://example.com/',
+    # expected to die with "Protocol not supported"
+    'http://127.0.0.1/',
+    'http://[::1]/',
+)
+
+
+async def _expect_failure(coro: Awaitable[Any]) -> None:
+    with pytest.raises(RuntimeError):
+        await coro
+
+
+@pytest.fixture(scope='module')
+async def running_prison() -> AsyncGenerator[Prison, None]:
+    prison = await start_prison(_ROOT, hostname=_HOSTNAME)
+
+    yield prison
 
-@pytest.mark.skipif(not sys.platform.startswith('freebsd'), reason='prison tests only supported on FreeBSD')
-@pytest.mark.skipif(os.getuid() != 0, reason='prison tests must be run as root')
-@pytest.mark.skipif('IM_OK_WITH_LEFTOVERS' not in os.environ, reason='please set IM_OK_WITH_LEFTOVERS env var if you acknowledge that these tests may produce leftover prisons')
-async def test_prison():
-    prison = await start_prison(Path('/'), hostname='reprise_test_prison')
-    assert await prison.is_running()
-    assert prison.get_path() == Path('/')
-    assert await prison.execute('hostname') == ['reprise_test_prison']
     await prison.destroy()
     assert not await prison.is_running()
 
 
+@pytest.fixture(scope='module')
+async def nonetwork_prison() -> AsyncGenerator[Prison, None]:
+    prison = await start_prison(_ROOT, hostname=_NONETWORK_HOSTNAME, networking=NetworkingMode.DISABLED)
+
+    yield prison
+
+    await prison.destroy()
+
+
 @pytest.mark.skipif(not sys.platform.startswith('freebsd'), reason='prison tests only supported on FreeBSD')
 @pytest.mark.skipif(os.getuid() != 0, reason='prison tests must be run as root')
 @pytest.mark.skipif('IM_OK_WITH_LEFTOVERS' not in os.environ, reason='please set IM_OK_WITH_LEFTOVERS env var if you acknowledge that these tests may produce leftover prisons')
-async def test_nonetwork():
-    prison = await start_prison(Path('/'), hostname='reprise_test_prison_nonetwork', networking=NetworkingMode.DISABLED)
+async def test_prison(running_prison, spawned_processes):
+    assert await running_prison.is_running()
+    assert running_prison.get_path() == _ROOT
 
-    # expected to die with "Non-recoverable resolver failure"
-    with pytest.raises(RuntimeError):
-        await prison.execute('fetch', 'http://example.com/')
+    spawned_processes.clear()
+    assert await running_prison.execute('hostname') == [_HOSTNAME]
 
-    # expected to die with "Protocol not supported"
-    with pytest.raises(RuntimeError):
-        await prison.execute('fetch', 'http://127.0.0.1/')
+    # the command is run in the prison directly, not through jexec
+    assert JEXEC_CMD not in spawned_processes[0]
 
-    with pytest.raises(RuntimeError):
-        await prison.execute('fetch', 'http://[::1]/')
 
-    await prison.destroy()
+@pytest.mark.skipif(not sys.platform.startswith('freebsd'), reason='prison tests only supported on FreeBSD')
+@pytest.mark.skipif(os.getuid() != 0, reason='prison tests must be run as root')
+@pytest.mark.skipif('IM_OK_WITH_LEFTOVERS' not in os.environ, reason='please set IM_OK_WITH_LEFTOVERS env var if you acknowledge that these tests may produce leftover prisons')
+async def test_nonetwork(nonetwork_prison):
+    await asyncio.gather(*(_expect_failure(nonetwork_prison.execute('fetch', url)) for url in _UNREACHABLE_URLS))
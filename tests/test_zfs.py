@@ -17,61 +17,53 @@
 
 import asyncio
 import os
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, AsyncGenerator
+from typing import AsyncGenerator, Iterator
 
 import pytest
 
 from reprise.zfs import ZFS
 
-_ENVNAME = 'REPRISE_TEST_ZFS_POOL'
+_SNAPSHOT = 'my_snapshot'
 
 
-def _write(path: Path, data: str) -> None:
-    with open(path, 'w') as fd:
-        fd.write(data)
+@contextmanager
+def _opened(path: Path, flags: int) -> Iterator[int]:
+    fd = os.open(path, flags)
+    try:
+        yield fd
+    finally:
+        os.close(fd)
 
 
-def _read(path: Path) -> str:
-    with open(path, 'r') as fd:
-        return fd.read()
+# file operations are offloaded to threads so the event loop is not
+# blocked while the dataset is busy
+async def _write(fd: int, data: str) -> None:
+    def write() -> None:
+        encoded = data.encode()
+        os.pwrite(fd, encoded, 0)
+        os.ftruncate(fd, len(encoded))
 
+    await asyncio.to_thread(write)
 
-# we have to redefine event_loop fixture with the module scope
-@pytest.fixture(scope='module')
-def event_loop():
-    loop = asyncio.get_event_loop_policy().new_event_loop()
-    yield loop
-    loop.close()
 
+async def _read(fd: int) -> str:
+    def read() -> str:
+        return os.pread(fd, os.fstat(fd).st_size, 0).decode()
 
-@pytest.fixture(scope='module')
-def zfs_pool() -> Path:
-    pool = os.environ.get(_ENVNAME)
-    if pool is None:
-        pytest.skip('no test ZFS pool defined with REPRISE_TEST_ZFS_POOL environment variable')
-    else:
-        return Path(pool)
+    return await asyncio.to_thread(read)
 
 
-@pytest.fixture(scope='module')
-async def zfs(zfs_pool) -> AsyncGenerator[Any, ZFS]:
-    # provide a dedicated dataset at the root of the pool
-    # for this module and clean it up after use
-    zfs = ZFS(zfs_pool).get_child('reprise_test')
-
-    if await zfs.exists():
-        await zfs.destroy()
+@pytest.fixture
+async def snapshot_zfs(zfs) -> AsyncGenerator[ZFS, None]:
+    zfs = zfs.get_child('snapshot')
 
     await zfs.create()
-    assert await zfs.exists()
-
-    await zfs.resolve_mountpoint()
 
     yield zfs
 
     await zfs.destroy()
-    assert not await zfs.exists()
 
 
 async def test_create_destroy(zfs):
@@ -84,25 +76,31 @@ async def test_create_destroy(zfs):
     assert not await zfs.exists()
 
 
-async def test_snapshot(zfs):
-    zfs = zfs.get_child('snapshot')
-
-    await zfs.create()
+async def test_snapshot(snapshot_zfs, spawned_processes):
+    zfs = snapshot_zfs
 
     path = zfs.get_path() / 'data'
 
-    _write(path, 'before_snapshot')
+    # a single descriptor serves all checks until rollback
+    # replaces dataset contents
+    with _opened(path, os.O_RDWR | os.O_CREAT) as fd:
+        await _write(fd, 'before_snapshot')
+
+        await zfs.snapshot(_SNAPSHOT)
 
-    await zfs.snapshot('my_snapshot')
+        assert await _read(fd) == 'before_snapshot'
 
-    assert _read(path) == 'before_snapshot'
+        await _write(fd, 'after_snapshot')
 
-    _write(path, 'after_snapshot')
+        assert await _read(fd) == 'after_snapshot'
 
-    assert _read(path) == 'after_snapshot'
+    spawned_processes.clear()
+    await zfs.rollback(_SNAPSHOT)
 
-    await zfs.rollback('my_snapshot')
+    # rollback must not enumerate snapshots beforehand
+    assert [args[1] for args in spawned_processes] == ['rollback']
 
-    assert _read(path) == 'before_snapshot'
+    with _opened(path, os.O_RDONLY) as fd:
+        assert await _read(fd) == 'before_snapshot'
 
-    await zfs.destroy_snapshot('my_snapshot')
+    await zfs.destroy_snapshot(_SNAPSHOT)